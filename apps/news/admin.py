@@ -1,17 +1,52 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.utils.translation import ugettext_lazy as _
 from . import models
+from . import search
+
+
+class PostChangeList(ChangeList):
+
+    def get_query_set(self):
+        # search through full-text index instead of ``search_fields`` lookups
+        query, self.query = self.query, ''
+        try:
+            qs = super(PostChangeList, self).get_query_set()
+        finally:
+            self.query = query
+        if query:
+            qs = search.search(qs, query)
+        return qs
+
+    def get_results(self, request):
+        # only displayed posts are loaded deferred: actions get query set
+        # from ``get_query_set`` and deletion of deferred instances sends
+        # signals with deferred class as sender, which ``Post`` handlers
+        # are not connected to
+        self.query_set = self.query_set.for_admin()
+        super(PostChangeList, self).get_results(request)
 
 
 class PostAdmin(admin.ModelAdmin):
-    list_display = ('title', 'is_published', 'date_published', 'author', 'tags')
+    list_display = ('title', 'is_published', 'date_published',
+        'date_scheduled', 'author', 'tags')
     list_display_links = ('title',)
     list_filter = ('is_published',)
     prepopulated_fields = {'slug': ('title',)}
     exclude = ('date_published',)
+    # searched by ``PostChangeList`` through full-text index, see
+    # ``apps.news.search``
     search_fields = ('author__username', 'author__first_name', 'title', 'content')
     actions = ('publish_posts', 'recall_posts')
 
+    def get_changelist(self, request, **kwargs):
+        return PostChangeList
+
+    def save_model(self, request, obj, form, change):
+        if 'date_scheduled' in form.changed_data:
+            obj.scheduled_by = request.user
+        obj.save()
+
     # post publishing actions
 
     def publish_posts(self, request, queryset):
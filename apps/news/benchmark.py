@@ -0,0 +1,247 @@
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db import models as db_models, transaction
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+
+import vk
+
+from . import caching
+from . import models
+
+# Benchmark of news hot paths. ``seed`` fills database with posts, users and
+# their security subjects, ``run`` measures query count, wall time and peak
+# memory of every operation. Meant to be run against a dedicated (SQLite)
+# database, see ``news_benchmark`` management command.
+
+SEED_PREFIX = 'bench'
+# modules whose import cost is measured by ``measure_imports``
+IMPORT_MODULES = ('vk', 'vk.security', 'vk.news', 'apps.news.models',
+    'apps.news.views')
+
+
+def _create_object(model, index):
+    """ Create model instance filling required text and number fields. """
+    values = {}
+    for field in model._meta.fields:
+        if (field.auto_created or field.null or field.blank or
+                field.has_default()):
+            continue
+        if isinstance(field, (db_models.CharField, db_models.TextField)):
+            value = '%s-%s-%i' % (SEED_PREFIX, model._meta.module_name, index)
+            values[field.attname] = value[:field.max_length or None]
+        elif isinstance(field, (db_models.IntegerField,
+                db_models.FloatField, db_models.DecimalField)):
+            values[field.attname] = index
+    return model._default_manager.create(**values)
+
+
+def _get_profile_model():
+    from django.db.models import get_model
+    return get_model(*settings.AUTH_PROFILE_MODULE.split('.'))
+
+
+def seed(posts=1000, users=100, groups=10, companies=10, cities=10,
+        published=0.8, stdout=None):
+    """ Create benchmark data. Every user gets random group, company and
+        city, posts get random authors (the first one is written by the first
+        user) and ``published`` share of them is published.
+    """
+    profile_model = _get_profile_model()
+    company_model = profile_model._meta.get_field('companies').rel.to
+    city_model = profile_model._meta.get_field('cities').rel.to
+    rnd = random.Random(0)
+    with transaction.commit_on_success():
+        group_objs = [Group.objects.create(name='%s-group-%i' % (
+            SEED_PREFIX, i)) for i in range(groups)]
+        company_objs = [_create_object(company_model, i)
+            for i in range(companies)]
+        city_objs = [_create_object(city_model, i) for i in range(cities)]
+        user_objs = []
+        for i in range(users):
+            user = User.objects.create(username='%s-user-%i' % (
+                SEED_PREFIX, i), first_name='Bench', last_name=str(i))
+            profile, created = profile_model._default_manager.get_or_create(
+                user=user)
+            user.groups.add(rnd.choice(group_objs))
+            profile.companies.add(rnd.choice(company_objs))
+            profile.cities.add(rnd.choice(city_objs))
+            user_objs.append(user)
+    pks = []
+    for chunk in models.chunks(range(posts)):
+        with transaction.commit_on_success():
+            for i in chunk:
+                post = models.Post(title='%s post %i' % (SEED_PREFIX, i),
+                    author=i and rnd.choice(user_objs) or user_objs[0],
+                    content='Post *%i* content' % i,
+                    teaser='Post %i teaser' % i,
+                    tags='bench tag%i' % (i % 50))
+                post.save()
+                if rnd.random() < published:
+                    pks.append(post.pk)
+        if stdout:
+            stdout.write("%i post(s) created\n" % (chunk[-1] + 1))
+    for chunk in models.chunks(pks):
+        models.Post.objects.filter(pk__in=chunk).publish()
+    return user_objs
+
+
+def _peak_memory():
+    """ Peak resident set size of the process (KB on Linux). """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(func, repeat=1, setup=None):
+    """ Call function ``repeat`` times and return dictionary with number of
+        queries of the last call, minimal wall time and peak memory growth.
+
+        :param setup: function called before every call of ``func``, which is
+            not measured.
+    """
+    # queries to all databases, replicas included, are counted
+    vk.instrumentation.install_query_counter()
+    best = None
+    memory = _peak_memory()
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        queries = vk.instrumentation.get_query_count()
+        start = time.time()
+        try:
+            func()
+        finally:
+            # reads of the following calls must not stay pinned to the
+            # write database (see ``vk.routing``)
+            vk.routing.unpin()
+        elapsed = time.time() - start
+        queries = vk.instrumentation.get_query_count() - queries
+        if best is None or elapsed < best:
+            best = elapsed
+    return {
+        'queries': queries,
+        'time': best,
+        'peak_memory_growth': _peak_memory() - memory,
+    }
+
+
+_IMPORT_SCRIPT = """import sys, time
+from django.conf import settings
+settings.INSTALLED_APPS
+before = set(sys.modules)
+start = time.time()
+import %s
+sys.stdout.write('%%f %%i' %% (time.time() - start,
+    len(set(sys.modules) - before)))
+"""
+
+
+def measure_import(module, repeat=3):
+    """ Import module in fresh interpreter ``repeat`` times and return
+        dictionary with minimal wall time and number of modules loaded by the
+        import. Interpreter uses settings and path of current process, cost
+        of loading settings is not included.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    best = None
+    for i in range(repeat):
+        process = subprocess.Popen([sys.executable, '-c',
+            _IMPORT_SCRIPT % module], stdout=subprocess.PIPE, env=env)
+        output = process.communicate()[0]
+        if process.returncode:
+            raise RuntimeError("Failed to import %s" % module)
+        elapsed, modules = output.split()
+        if best is None or float(elapsed) < best:
+            best = float(elapsed)
+    return {'time': best, 'modules': int(modules)}
+
+
+def measure_imports(modules=IMPORT_MODULES, repeat=3):
+    """ Return dictionary mapping module names to their import costs. """
+    return dict((module, measure_import(module, repeat))
+        for module in modules)
+
+
+def get_operations(user):
+    """ Return list of ``(name, function, setup)`` tuples to benchmark on
+        behalf of ``user``, see ``measure``.
+    """
+    from django.contrib.auth.models import AnonymousUser
+    from . import feeds
+
+    factory = RequestFactory()
+    posts = list(models.Post.objects.filter(author=user).order_by('pk')[:1])
+    if not posts:
+        raise ValueError("User %s has no posts, seed the database first" %
+            user.username)
+    post = posts[0]
+    drafts = list(models.Post.objects.filter(is_published=False).values_list(
+        'pk', flat=True)[:100])
+
+    def index():
+        list(vk.news.get_posts_for_user(user)[:models.BULK_CHUNK_SIZE])
+
+    def index_anonymous():
+        list(vk.news.get_posts_for_user(AnonymousUser())[
+            :models.BULK_CHUNK_SIZE])
+
+    def latest():
+        list(vk.news.get_latest_published(user))
+
+    def permission_required():
+        view = vk.security.permission_required(
+            models.Operations.CHANGE_POST, (models.Post, 'slug', 'slug'))(
+                lambda request, slug: HttpResponse())
+        request = factory.get('/')
+        request.user = vk.security.get_user(user.pk)
+        view(request, slug=post.slug)
+
+    def feed():
+        # cached view served by urls
+        feeds.feed(factory.get('/'), 'latest', {'latest': feeds.LatestPosts})
+
+    def invalidate_feed():
+        # every call renders LatestPosts instead of hitting the cache
+        caching.touch()
+
+    # every call publishes or recalls the same drafts, so their state is
+    # reset before it
+    def publish():
+        models.Post.objects.filter(pk__in=drafts).publish()
+
+    def recall():
+        models.Post.objects.filter(pk__in=drafts).recall()
+
+    return [
+        ('get_posts_for_user', index, None),
+        ('get_posts_for_user.anonymous', index_anonymous, None),
+        ('get_latest_published', latest, None),
+        ('permission_required', permission_required, None),
+        ('LatestPosts', feed, invalidate_feed),
+        ('PostQuerySet.publish', publish, recall),
+        ('PostQuerySet.recall', recall, publish),
+    ]
+
+
+def run(user, repeat=3):
+    """ Benchmark news hot paths on behalf of user. Return dictionary
+        mapping operation names to their measurements.
+    """
+    return dict((name, measure(func, repeat, setup))
+        for name, func, setup in get_operations(user))
+
+
+def compare(results, baseline):
+    """ Return list of operations issuing more queries than in baseline. """
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is not None and result['queries'] > expected['queries']:
+            regressions.append((name, expected['queries'],
+                result['queries']))
+    return regressions
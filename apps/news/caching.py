@@ -0,0 +1,88 @@
+import datetime
+import time
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import get_language
+
+# cache backend alias used by news application
+CACHE_ALIAS = getattr(settings, 'NEWS_CACHE', 'default')
+STAMP_KEY = 'news.stamp'
+# stamp is regenerated when expired, which only invalidates cached values
+STAMP_TIMEOUT = 60 * 60 * 24 * 30
+# seconds to keep rendered pages of published posts for anonymous users
+PAGE_TIMEOUT = getattr(settings, 'NEWS_PAGE_CACHE_TIMEOUT', 60 * 10)
+# headers stored along with content of cached responses
+RESPONSE_HEADERS = ('Content-Type', 'Vary', 'Cache-Control', 'Last-Modified')
+
+
+def get_news_cache():
+    """ Return cache backend configured by ``NEWS_CACHE`` setting. """
+    return get_cache(CACHE_ALIAS)
+
+
+def get_stamp():
+    """ Return time of the last change of news posts (seconds since epoch).
+        Cached values depending on posts should include it into their keys.
+    """
+    cache = get_news_cache()
+    stamp = cache.get(STAMP_KEY)
+    if stamp is None:
+        stamp = time.time()
+        cache.add(STAMP_KEY, stamp, STAMP_TIMEOUT)
+        stamp = cache.get(STAMP_KEY, stamp)
+    return stamp
+
+
+def get_last_modified():
+    """ Return time of the last change of news posts as datetime. """
+    return datetime.datetime.fromtimestamp(int(get_stamp()))
+
+
+def touch():
+    """ Mark news posts as changed, which invalidates all cached values
+        depending on the stamp.
+    """
+    get_news_cache().set(STAMP_KEY, time.time(), STAMP_TIMEOUT)
+
+
+def _hash(value):
+    return md5_constructor(value.encode('utf-8')).hexdigest()
+
+
+def get_post_key(slug, site_id=None):
+    """ Return key ``date_updated`` of post ``slug`` published on site
+        (the current one by default) is cached under.
+    """
+    return 'news.post.%s' % _hash(u'%s:%s' % (site_id or settings.SITE_ID,
+        slug))
+
+
+def get_page_key(slug, date_updated):
+    """ Return key rendered page of post version is cached under. """
+    return 'news.page.%s' % _hash(u'%s:%s:%s:%s' % (settings.SITE_ID, slug,
+        date_updated.isoformat(), get_language()))
+
+
+def pack_response(response):
+    """ Return value rendered ``response`` is cached as. """
+    return response.content, dict((name, response[name])
+        for name in RESPONSE_HEADERS if response.has_header(name))
+
+
+def unpack_response(value):
+    """ Return response from value returned by ``pack_response``. """
+    content, headers = value
+    response = HttpResponse(content)
+    for name, header in headers.items():
+        response[name] = header
+    return response
+
+
+def invalidate_posts(slugs, site_id=None):
+    """ Forget cached versions of posts ``slugs`` of site (the current one
+        by default), which makes their cached pages unreachable.
+    """
+    get_news_cache().delete_many([get_post_key(slug, site_id)
+        for slug in slugs])
@@ -1,8 +1,14 @@
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.syndication.feeds import Feed
+from django.contrib.syndication.views import feed as feed_view
 from django.core.urlresolvers import reverse
-from django.utils.translation import ugettext_lazy as _
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import get_language, ugettext_lazy as _
+from django.views.decorators.http import condition
+from tagging.models import Tag
 
+from . import caching
 from . import models
 
 RECENT_NEWS_POSTS_COUNT = getattr(settings, "RECENT_NEWS_POSTS_COUNT", 10)
@@ -25,12 +31,65 @@ class LatestPosts(NewsFeed):
     description = title
 
     def items(self):
-        return models.Post.objects.published()[:ITEMS_PER_FEED]
+        return models.Post.objects.on_site().published().summaries(
+            content=True)[:ITEMS_PER_FEED]
 
     def item_author_name(self, post):
-        if post.author:
-            return post.author.get_full_name()
-        return _("Anonymous")
+        return post.author_name or _("Anonymous")
 
     def item_pubdate(self, post):
         return post.date_published
+
+
+class TaggedPosts(LatestPosts):
+    """ Latest posts tagged with tag given in the last feed URL part. """
+
+    def get_object(self, bits):
+        if len(bits) != 1:
+            raise ObjectDoesNotExist
+        return Tag.objects.get(name=bits[0])
+
+    def title(self, tag):
+        return _("Latest news posts tagged %s") % tag.name
+
+    def description(self, tag):
+        return self.title(tag)
+
+    def link(self, tag):
+        return reverse('news_tag', args=[tag.name])
+
+    def items(self, tag):
+        return models.Post.objects.on_site().published().tagged(tag
+            ).summaries(content=True)[:ITEMS_PER_FEED]
+
+
+def _get_feed_key(url):
+    key = '%s:%s:%s:%s' % (settings.SITE_ID, url, get_language(),
+        caching.get_stamp())
+    return 'news.feed.%s' % md5_constructor(key.encode('utf-8')).hexdigest()
+
+
+def _feed_etag(request, url, feed_dict=None):
+    return _get_feed_key(url)
+
+
+def _feed_last_modified(request, url, feed_dict=None):
+    return caching.get_last_modified()
+
+
+@condition(etag_func=_feed_etag, last_modified_func=_feed_last_modified)
+def feed(request, url, feed_dict=None):
+    """ Cached version of ``django.contrib.syndication.views.feed``.
+
+        Rendered feeds are kept in ``NEWS_CACHE`` backend for ``NEWS_FEED_TTL``
+        minutes or until any post is saved, published, recalled or deleted.
+    """
+    cache = caching.get_news_cache()
+    key = _get_feed_key(url)
+    cached = cache.get(key)
+    if cached is not None:
+        return caching.unpack_response(cached)
+    response = feed_view(request, url, feed_dict)
+    if response.status_code == 200:
+        cache.set(key, caching.pack_response(response), FEED_TTL * 60)
+    return response
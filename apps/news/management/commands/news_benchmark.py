@@ -0,0 +1,72 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = ("Benchmark news hot paths: seed database with posts, users and "
+        "security subjects and record query count, wall time and peak memory "
+        "of every operation and import cost of modules as JSON. Run it "
+        "against a dedicated database.")
+    option_list = BaseCommand.option_list + (
+        make_option('--posts', type='int', dest='posts', default=1000,
+            help='Number of posts to create.'),
+        make_option('--users', type='int', dest='users', default=100,
+            help='Number of users to create.'),
+        make_option('--groups', type='int', dest='groups', default=10,
+            help='Number of groups to create.'),
+        make_option('--companies', type='int', dest='companies', default=10,
+            help='Number of companies to create.'),
+        make_option('--cities', type='int', dest='cities', default=10,
+            help='Number of cities to create.'),
+        make_option('--no-seed', action='store_false', dest='seed',
+            default=True, help='Use data created by previous run.'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+            help='Number of times every operation is repeated.'),
+        make_option('--output', dest='output',
+            help='Write results into file instead of standard output.'),
+        make_option('--baseline', dest='baseline',
+            help='Fail if any operation issues more queries than in results '
+                'of previous run stored in this file.'),
+    )
+
+    def handle(self, **options):
+        from django.contrib.auth.models import User
+        from ... import benchmark
+        sizes = dict((name, options[name]) for name in
+            ('posts', 'users', 'groups', 'companies', 'cities'))
+        if options['seed']:
+            users = benchmark.seed(stdout=self.stdout, **sizes)
+            user = users[0]
+        else:
+            users = list(User.objects.filter(username__startswith='%s-user-'
+                % benchmark.SEED_PREFIX).order_by('pk')[:1])
+            if not users:
+                raise CommandError("No benchmark data found, run without "
+                    "--no-seed first.")
+            user = users[0]
+        try:
+            operations = benchmark.run(user, options['repeat'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        results = {
+            'database': connection.settings_dict['ENGINE'],
+            'sizes': sizes,
+            'operations': operations,
+            'imports': benchmark.measure_imports(repeat=options['repeat']),
+        }
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options.get('output'):
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output + '\n')
+        if options.get('baseline'):
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['operations']
+            regressions = benchmark.compare(results['operations'], baseline)
+            if regressions:
+                raise CommandError("Query count regressions: %s" % ', '.join(
+                    '%s (%i > %i)' % (name, result, expected)
+                        for name, expected, result in regressions))
@@ -0,0 +1,24 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Check visibility index of news posts against RBAC data."
+    option_list = BaseCommand.option_list + (
+        make_option('--fix', action='store_true', dest='fix', default=False,
+            help='Rebuild index of inconsistent posts.'),
+    )
+
+    def handle(self, **options):
+        import vk
+        from ...models import Post
+        inconsistent = set()
+        for post, message in vk.news.check_visibility_index():
+            inconsistent.add(post.pk)
+            self.stderr.write("%s (%s): %s\n" % (post.slug, post.pk, message))
+        if inconsistent and options.get('fix'):
+            vk.news.rebuild_visibility_index(
+                Post.objects.filter(pk__in=inconsistent))
+        elif inconsistent:
+            raise CommandError("%i inconsistent post(s) found" %
+                len(inconsistent))
@@ -0,0 +1,34 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Propagate permissions of posts queued in deferred mode."
+    option_list = BaseCommand.option_list + (
+        make_option('--verify', action='store_true', dest='verify',
+            default=False,
+            help='Check permissions of processed posts afterwards.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=None, help='Number of tasks processed per transaction.'),
+    )
+
+    def handle(self, **options):
+        import vk
+        from ... import models
+        kwargs = {}
+        if options.get('batch_size'):
+            kwargs['batch_size'] = options['batch_size']
+        pks = vk.news.drain_permission_tasks(**kwargs)
+        verbosity = int(options.get('verbosity', 1))
+        if verbosity:
+            self.stdout.write("%i post(s) processed, %i task(s) queued\n" % (
+                len(set(pks)), models.PermissionTask.objects.count()))
+        if not options.get('verify'):
+            return
+        inconsistent = set()
+        for post, message in vk.news.check_permission_tasks(set(pks)):
+            inconsistent.add(post.pk)
+            self.stderr.write("%s (%s): %s\n" % (post.slug, post.pk, message))
+        if inconsistent:
+            raise CommandError("%i inconsistent post(s) found" %
+                len(inconsistent))
@@ -0,0 +1,38 @@
+import sys
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.utils import simplejson
+
+
+class Command(BaseCommand):
+    help = "Export news posts as JSON Lines, one post per line."
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+            help='File to write posts into, standard output by default.'),
+        make_option('--site', type='int', dest='site', default=None,
+            help='Export posts of site with given id only.'),
+        make_option('--published', action='store_true', dest='published',
+            default=False, help='Export published posts only.'),
+    )
+
+    def handle(self, **options):
+        import vk
+        from ...models import Post
+        posts = Post.objects.all()
+        if options.get('site') is not None:
+            posts = posts.filter(site=options['site'])
+        if options.get('published'):
+            posts = posts.published()
+        output = sys.stdout
+        if options.get('output'):
+            output = open(options['output'], 'w')
+        count = 0
+        try:
+            for row in vk.news.export_posts(posts):
+                output.write(simplejson.dumps(row) + '\n')
+                count += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        if int(options.get('verbosity', 1)):
+            self.stderr.write("%i post(s) exported\n" % count)
@@ -0,0 +1,65 @@
+import sys
+from optparse import make_option
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
+
+
+class Command(BaseCommand):
+    args = '[file]'
+    help = ("Import news posts from JSON Lines written by news_export. "
+        "Posts with existing uid are skipped, so import can be resumed.")
+    option_list = BaseCommand.option_list + (
+        make_option('--site', type='int', dest='site', default=None,
+            help='Site id of imported posts, current site by default.'),
+        make_option('--default-author', dest='default_author', default=None,
+            help='Username of author of posts whose author does not exist.'),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=None, help='Number of posts imported per transaction.'),
+    )
+
+    def _read(self, input):
+        for number, line in enumerate(input):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield simplejson.loads(line)
+            except ValueError as e:
+                raise CommandError("Line %i: %s" % (number + 1, e))
+
+    def handle(self, *args, **options):
+        import vk
+        default_author = None
+        if options.get('default_author'):
+            try:
+                default_author = User.objects.get(
+                    username=options['default_author'])
+            except User.DoesNotExist:
+                raise CommandError("User %s does not exist" %
+                    options['default_author'])
+        kwargs = {}
+        if options.get('chunk_size'):
+            kwargs['chunk_size'] = options['chunk_size']
+        input = sys.stdin
+        if args:
+            input = open(args[0])
+        verbosity = int(options.get('verbosity', 1))
+        imported = skipped = 0
+        try:
+            for chunk_imported, chunk_skipped in vk.news.import_posts(
+                    self._read(input), site=options.get('site'),
+                    default_author=default_author, **kwargs):
+                imported += chunk_imported
+                skipped += chunk_skipped
+                if verbosity > 1:
+                    self.stderr.write("%i imported, %i skipped\n" % (
+                        imported, skipped))
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            if input is not sys.stdin:
+                input.close()
+        if verbosity:
+            self.stderr.write("%i post(s) imported, %i skipped\n" % (
+                imported, skipped))
@@ -0,0 +1,36 @@
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("Publish news posts whose scheduled publication time has come. "
+        "Safe to run on several nodes at once.")
+    option_list = BaseCommand.option_list + (
+        make_option('--interval', type='int', dest='interval', default=0,
+            help='Keep running, checking for due posts every INTERVAL '
+                'seconds.'),
+    )
+
+    def tick(self, verbosity):
+        import vk
+        from ...models import Post
+        count = 0
+        while True:
+            # due posts are read from the write database and pins made by
+            # publishing end with the batch, see ``vk.routing``
+            with vk.routing.pinned():
+                pks = Post.objects.publish_due()
+            count += len(pks)
+            if not pks:
+                break
+        if verbosity and count:
+            self.stdout.write("%i post(s) published\n" % count)
+
+    def handle(self, **options):
+        interval = options.get('interval')
+        verbosity = int(options.get('verbosity', 1))
+        self.tick(verbosity)
+        while interval:
+            time.sleep(interval)
+            self.tick(verbosity)
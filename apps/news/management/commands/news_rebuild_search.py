@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Rebuild full-text search index of news posts."
+
+    def handle(self, **options):
+        from ... import search
+        from ...models import Post
+        count = search.rebuild(Post.objects.all())
+        if int(options.get('verbosity', 1)):
+            self.stdout.write("%i post(s) indexed\n" % count)
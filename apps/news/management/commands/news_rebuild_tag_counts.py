@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = "Recount published news posts of every tag."
+
+    def handle(self, **options):
+        from ...models import PublishedTagCount
+        with transaction.commit_on_success():
+            PublishedTagCount.objects.rebuild()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Rebuild visibility index of news posts."
+
+    def handle(self, **options):
+        import vk
+        count = vk.news.rebuild_visibility_index()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write("%i post(s) indexed\n" % count)
@@ -0,0 +1,48 @@
+import operator
+from functools import reduce
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from ... import caching
+from ... import markup
+from ... import models
+
+
+class Command(BaseCommand):
+    help = ("Render markup of news posts and store it in the rendered "
+        "columns and markup cache. Run after markup renderers or their "
+        "extensions change.")
+    option_list = BaseCommand.option_list + (
+        make_option('--missing', action='store_true', dest='missing',
+            default=False,
+            help='Render posts without rendered markup only and use cached '
+                'markup if available.'),
+    )
+
+    def handle(self, **options):
+        missing = options.get('missing')
+        verbosity = int(options.get('verbosity', 1))
+        fields = [f for f in models.Post._meta.fields
+            if isinstance(f, markup.CachedMarkupField)]
+        qs = models.Post.objects.all()
+        if missing:
+            qs = qs.filter(reduce(operator.or_,
+                [Q(**{markup.get_rendered_field_name(field): ''})
+                    for field in fields]))
+        count = 0
+        for post in qs.iterator():
+            values = {}
+            for field in fields:
+                value = getattr(post, field.attname)
+                if value is None:
+                    continue
+                values[markup.get_rendered_field_name(field)] = (
+                    markup.render_markup(field, value.markup_type, value.raw,
+                        force=not missing))
+            # update rendered columns only, avoiding save() and its signals
+            models.Post.objects.filter(pk=post.pk).update(**values)
+            count += 1
+        caching.touch()
+        if verbosity > 0:
+            self.stdout.write("%i post(s) rendered\n" % count)
@@ -0,0 +1,63 @@
+import zlib
+from django.conf import settings
+from django.utils.hashcompat import md5_constructor
+from django.utils.html import escape
+from markupfield.fields import MarkupField
+
+from . import caching
+
+# bump to invalidate cached markup after renderers or extensions change
+MARKUP_VERSION = getattr(settings, 'NEWS_MARKUP_VERSION', 1)
+MARKUP_CACHE_TIMEOUT = getattr(settings, 'NEWS_MARKUP_CACHE_TIMEOUT',
+    60 * 60 * 24 * 30)
+
+
+def _get_markup_key(markup_type, raw):
+    digest = md5_constructor(raw.encode('utf-8')).hexdigest()
+    return 'news.markup.%s.%s.%s' % (MARKUP_VERSION, markup_type, digest)
+
+
+def render_markup(field, markup_type, raw, force=False):
+    """ Render markup source with ``field`` renderer for ``markup_type``.
+
+        Rendered HTML is compressed and kept in ``NEWS_CACHE`` backend keyed
+        by markup type and content hash, so unchanged source is rendered once
+        no matter how many times the post is saved.
+
+        :param force: ignore cached value and render source again.
+    """
+    if not raw:
+        return u''
+    cache = caching.get_news_cache()
+    key = _get_markup_key(markup_type, raw)
+    if not force:
+        cached = cache.get(key)
+        if cached is not None:
+            return zlib.decompress(cached).decode('utf-8')
+    if getattr(field, 'escape_html', False):
+        raw = escape(raw)
+    rendered = field.markup_choices_dict[markup_type](raw)
+    cache.set(key, zlib.compress(rendered.encode('utf-8')),
+        MARKUP_CACHE_TIMEOUT)
+    return rendered
+
+
+class CachedMarkupField(MarkupField):
+    """ ``MarkupField`` rendering its value through the markup cache. """
+
+    def pre_save(self, model_instance, add):
+        value = super(MarkupField, self).pre_save(model_instance, add)
+        if value.markup_type not in self.markup_choices_list:
+            raise ValueError('Invalid markup type (%s), allowed values: %s' %
+                (value.markup_type, ', '.join(self.markup_choices_list)))
+        setattr(model_instance, get_rendered_field_name(self),
+            render_markup(self, value.markup_type, value.raw))
+        return value.raw
+
+
+def get_rendered_field_name(field):
+    return '_%s_rendered' % field.attname
+
+
+def get_markup_type_field_name(field):
+    return '%s_markup_type' % field.attname
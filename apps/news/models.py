@@ -1,19 +1,67 @@
 import datetime
+import uuid
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
-from django.db import models
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, models, router, transaction
+from django.db.models.query import EmptyQuerySet, ValuesQuerySet
+from django.dispatch import Signal
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext, ugettext_lazy as _
-from markupfield.fields import MarkupField
 from tagging.fields import TagField
+from tagging.models import Tag, TaggedItem
+from tagging.utils import parse_tag_input
 
-import utils
+import vk
+
+from . import caching
+from . import markup
+from . import search
+from . import tasks
 
 
 DEFAULT_MARKUP = getattr(settings, "NEWS_DEFAULT_MARKUP", "markdown")
 
 # it should be enough to hold UUID hash
 MAX_UID_LENGTH = max(getattr(settings, 'MAX_UID_LENGTH', 0), 36)
+# number of attempts to insert post with unique values regenerated
+MAX_SAVE_ATTEMPTS = 3
+
+
+def get_unique_slug(model, value, exclude_pk=None):
+    """ Return slug for ``value`` which is not taken by other ``model``
+        objects: slugified value itself or slugified value with the next free
+        numeric suffix (``slug-2``, ``slug-3``...). Taken slugs are fetched
+        with a single range query over the slug index.
+
+        :param exclude_pk: primary key of the object slug is generated for.
+    """
+    from pytils.translit import slugify
+    max_length = model._meta.get_field('slug').max_length
+    # leave room for numeric suffix
+    base = slugify(value)[:max_length - 6].strip('-') or 'post'
+    qs = model._default_manager.filter(models.Q(slug=base) | models.Q(
+        slug__gt=base + '-', slug__lt=base + '.'))
+    if exclude_pk is not None:
+        qs = qs.exclude(pk=exclude_pk)
+    taken = set(qs.values_list('slug', flat=True))
+    if base not in taken:
+        return base
+    suffixes = [1]
+    for slug in taken:
+        suffix = slug[len(base) + 1:]
+        if suffix.isdigit():
+            suffixes.append(int(suffix))
+    return '%s-%i' % (base, max(suffixes) + 1)
+
+
+def generate_uid():
+    """ Return random UUID string. It is unique without checking database,
+        rare collisions are handled by ``Post.save``.
+    """
+    return str(uuid.uuid4())
 
 
 class Operations:
@@ -33,56 +81,282 @@ class Roles:
     MODERATOR = 'news.moderator'
 
 
+# sent after posts have been published or recalled in bulk, ``pks`` is the
+# list of primary keys of affected posts
+posts_published = Signal(providing_args=['pks'])
+posts_recalled = Signal(providing_args=['pks'])
+
+# maximum number of primary keys passed into single query
+BULK_CHUNK_SIZE = 500
+
+# propagate permissions of published and recalled posts by worker instead of
+# in the request, see ``apps.news.tasks``
+DEFERRED_PERMISSIONS = getattr(settings, 'NEWS_DEFERRED_PERMISSIONS', False)
+
+
+def chunks(values, size=BULK_CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class PostSummary(object):
+    """ Read-only summary of post for lists and feeds, built from a narrow
+        ``values()`` query instead of full ``Post`` instance.
+    """
+    __slots__ = ('pk', 'title', 'slug', 'author_id', 'author_name',
+        'teaser_html', 'content_html', 'tags', 'is_published',
+        'date_published', 'date_created')
+
+    # columns selected for summaries, rendered content is selected on demand
+    FIELDS = ('pk', 'title', 'slug', 'author', 'author__username',
+        'author__first_name', 'author__last_name', '_teaser_rendered', 'tags',
+        'is_published', 'date_published', 'date_created')
+    CONTENT_FIELDS = ('_content_rendered',)
+
+    def __init__(self, row):
+        self.pk = row['pk']
+        self.title = row['title']
+        self.slug = row['slug']
+        self.author_id = row['author']
+        full_name = u'%s %s' % (row['author__first_name'],
+            row['author__last_name'])
+        self.author_name = full_name.strip() or row['author__username']
+        self.teaser_html = mark_safe(row['_teaser_rendered'] or '')
+        self.content_html = mark_safe(row.get('_content_rendered') or '')
+        self.tags = row['tags']
+        self.is_published = row['is_published']
+        self.date_published = row['date_published']
+        self.date_created = row['date_created']
+
+    def __unicode__(self):
+        return self.title
+
+    def __repr__(self):
+        return '<PostSummary: %s>' % self.pk
+
+    @property
+    def tag_list(self):
+        return parse_tag_input(self.tags)
+
+    def get_absolute_url(self):
+        view_names = ('news_post_preview', 'news_post_detail')
+        return reverse(view_names[self.is_published],
+            kwargs={'slug': self.slug})
+
+
+class PostSummaryQuerySet(ValuesQuerySet):
+    """ Yields ``PostSummary`` records instead of dictionaries. """
+
+    def iterator(self):
+        for row in super(PostSummaryQuerySet, self).iterator():
+            yield PostSummary(row)
+
+
 class PostQuerySet(models.query.QuerySet):
 
     def publish(self):
+        """ Publish posts, set date_published for posts which have not been
+            published before, cancel scheduled publication and grant
+            permissions to readers. Posts are updated in bulk, neither
+            ``Post.save`` nor signals are called.
+            Return number of posts which have not been published before.
+        """
+        using = self._db or router.db_for_write(self.model)
+        # following reads must see the changes, see ``vk.routing``
+        vk.routing.pin()
         now = datetime.datetime.now()
-        # force update permissions for posts with date_published set
-        rs = self.filter(date_published__isnull=False)
-        count = rs.update(is_published=True)
-        [p.publish() for p in rs]
-        # update permissions and date for posts with empty date_published
-        rs = self.filter(date_published__isnull=True)
-        count += rs.update(is_published=True, date_published=now)
-        [p.publish() for p in rs]
+        count = 0
+        pks = list(self.using(using).values_list('pk', flat=True))
+        with transaction.commit_on_success(using=using):
+            for chunk in chunks(pks):
+                rs = self.model._default_manager.using(using).filter(
+                    pk__in=chunk)
+                rs.filter(date_published__isnull=True).update(
+                    date_published=now)
+                count += rs.filter(is_published=False).update(
+                    is_published=True, date_updated=now, date_scheduled=None,
+                    scheduled_by=None)
+                PublishedTagCount.objects.update_for_posts(chunk)
+                if DEFERRED_PERMISSIONS:
+                    PermissionTask.objects.enqueue(chunk)
+                else:
+                    # force update permissions for already published posts
+                    vk.news.grant_published_permissions(rs)
+        posts_published.send(sender=self.model, pks=pks)
         return count
 
     def recall(self):
-        count = self.update(is_published=False)
-        [p.recall() for p in self]
+        """ Recall published posts, but leave date_published as is and revoke
+            permissions from readers. Posts are updated in bulk, neither
+            ``Post.save`` nor signals are called.
+            Return number of posts which have been published before.
+        """
+        using = self._db or router.db_for_write(self.model)
+        # following reads must see the changes, see ``vk.routing``
+        vk.routing.pin()
+        now = datetime.datetime.now()
+        count = 0
+        pks = list(self.using(using).values_list('pk', flat=True))
+        with transaction.commit_on_success(using=using):
+            for chunk in chunks(pks):
+                rs = self.model._default_manager.using(using).filter(
+                    pk__in=chunk)
+                count += rs.filter(is_published=True).update(
+                    is_published=False, date_updated=now)
+                PublishedTagCount.objects.update_for_posts(chunk)
+                if DEFERRED_PERMISSIONS:
+                    PermissionTask.objects.enqueue(chunk)
+                else:
+                    vk.news.revoke_published_permissions(rs)
+        posts_recalled.send(sender=self.model, pks=pks)
         return count
 
+    def published(self):
+        return self.filter(is_published=True)
+
+    def on_site(self, site=None):
+        """ Posts of site, current site by default. Combined with
+            ``published`` filters by index on ``(site, is_published,
+            date_published, date_created)``, see ``sql/post.sql``.
+        """
+        if site is None:
+            site = settings.SITE_ID
+        return self.filter(site=site)
+
+    def tagged(self, tag):
+        """ Posts tagged with ``tag``, looked up in ``TaggedItem`` index. """
+        return self.filter(pk__in=TaggedItem.objects.filter(tag=tag,
+            content_type=ContentType.objects.get_for_model(self.model)
+        ).values_list('object_id', flat=True))
+
+    # Query profiles select related objects consumers need and defer heavy
+    # columns they do not use. Instances loaded with deferred markup columns
+    # are meant for reading only. Lists and feeds read ``summaries``.
+
+    def for_detail(self):
+        """ Posts for detail pages: author and everything else. """
+        return self.select_related('author')
+
+    def for_admin(self):
+        """ Posts for admin change list: author and no markup at all. """
+        return self.select_related('author').defer('content', 'teaser',
+            '_content_rendered', '_teaser_rendered')
+
+    def summaries(self, content=False):
+        """ ``PostSummary`` records of posts with rendered teaser and, if
+            ``content`` is true, rendered content. Posts saved without
+            rendered markup have it empty, see ``news_render_markup``.
+        """
+        return get_summaries(self, content)
+
+
+def get_summaries(queryset, content=False):
+    """ Turn posts query set into ``PostSummaryQuerySet``, see
+        ``PostQuerySet.summaries``. Empty query sets are left as is.
+    """
+    if isinstance(queryset, EmptyQuerySet):
+        return queryset
+    fields = PostSummary.FIELDS
+    if content:
+        fields += PostSummary.CONTENT_FIELDS
+    return queryset._clone(klass=PostSummaryQuerySet, setup=True,
+        _fields=fields)
+
 
 class PostManager(models.Manager):
     use_for_related_fields = True
 
     def published(self):
-        return Post.objects.filter(is_published=True)
+        return self.get_query_set().published()
+
+    def on_site(self, site=None):
+        return self.get_query_set().on_site(site)
+
+    def tagged(self, tag):
+        return self.get_query_set().tagged(tag)
+
+    def for_detail(self):
+        return self.get_query_set().for_detail()
+
+    def for_admin(self):
+        return self.get_query_set().for_admin()
+
+    def summaries(self, content=False):
+        return self.get_query_set().summaries(content)
 
     def get_query_set(self):
         return PostQuerySet(self.model)
 
+    def publish_due(self, now=None, limit=BULK_CHUNK_SIZE):
+        """ Publish at most ``limit`` posts whose scheduled publication time
+            has come. Their publication date is set to the scheduled one.
+            Return list of primary keys of published posts.
+
+            Due posts are found by index on ``(is_published,
+            date_scheduled)``. Every post is claimed by conditional update
+            which locks it till the end of transaction, so schedulers running
+            concurrently never publish the same post twice.
+
+            Posts are published only if the user who has scheduled them (the
+            author if unknown) is still allowed to publish them, schedules of
+            other posts are cancelled.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        qs = self.get_query_set()
+        due = list(qs.filter(is_published=False, date_scheduled__lte=now)
+            .order_by('date_scheduled').only('author', 'scheduled_by')[:limit])
+        users = User.objects.in_bulk(set(
+            post.scheduled_by_id or post.author_id for post in due))
+        permitted = []
+        for post in due:
+            if vk.security.check_permission(
+                    users.get(post.scheduled_by_id or post.author_id),
+                    Operations.PUBLISH_POST, post):
+                permitted.append(post.pk)
+            else:
+                qs.filter(pk=post.pk, is_published=False).update(
+                    date_scheduled=None, scheduled_by=None)
+        claimed = []
+        with transaction.commit_on_success(
+                using=router.db_for_write(self.model)):
+            for pk in permitted:
+                if qs.filter(pk=pk, is_published=False,
+                        date_scheduled__lte=now).update(
+                        date_published=models.F('date_scheduled')):
+                    claimed.append(pk)
+            if claimed:
+                qs.filter(pk__in=claimed).publish()
+        return claimed
+
 
 class Post(models.Model):
     uid = models.CharField(max_length=MAX_UID_LENGTH, unique=True,
-        default=lambda: utils.get_unique_id_str(Post.is_key_unique))
+        default=generate_uid)
     site = models.ForeignKey(Site, editable=False, default=settings.SITE_ID,
         verbose_name=_('Site'))
     title = models.CharField(max_length=255, verbose_name=_('Title'))
-    slug = models.SlugField(max_length=64, db_index=True,
+    slug = models.SlugField(max_length=64, unique=True,
         verbose_name=_('Slug'))
     author = models.ForeignKey(User, related_name='news',
         verbose_name=_('Author'))
-    content = MarkupField(default_markup_type=DEFAULT_MARKUP,
+    content = markup.CachedMarkupField(default_markup_type=DEFAULT_MARKUP,
         verbose_name=_('Content'))
-    teaser = MarkupField(markup_type='plain', blank=True, null=True,
-        verbose_name=_('Teaser'))
+    teaser = markup.CachedMarkupField(markup_type='plain', blank=True,
+        null=True, verbose_name=_('Teaser'))
     date_created = models.DateTimeField(auto_now_add=True,
         verbose_name=_('Date Created'))
     date_updated = models.DateTimeField(auto_now=True, auto_now_add=True,
         verbose_name=_('Date Modified'))
     date_published = models.DateTimeField(blank=True, null=True,
         verbose_name=_('Date Published'))
+    date_scheduled = models.DateTimeField(blank=True, null=True,
+        verbose_name=_('Date Scheduled'),
+        help_text=_('Publish post automatically at this time.'))
+    # user whose permission to publish is checked when post is due
+    scheduled_by = models.ForeignKey(User, blank=True, null=True,
+        editable=False, related_name='scheduled_news',
+        verbose_name=_('Scheduled By'))
     is_published = models.BooleanField(default=False,
         verbose_name=_('Published'))
     tags = TagField(verbose_name=_('Tags'))
@@ -123,9 +397,34 @@ class Post(models.Model):
     def __unicode__(self):
         return self.title
 
-    @classmethod
-    def is_key_unique(cls, uid):
-        return utils.django.get_object_or_none(cls, uid=uid) is None
+    @property
+    def tag_list(self):
+        """ Tag names parsed from denormalized ``tags`` column. Unlike
+            ``tags_for_object`` template tag it does not query database.
+        """
+        return parse_tag_input(self.tags)
+
+    def _get_rendered_markup(self, name):
+        field = self._meta.get_field(name)
+        rendered_name = markup.get_rendered_field_name(field)
+        rendered = getattr(self, rendered_name)
+        # render lazily posts saved without markup rendering, unless markup
+        # source has been deferred
+        raw = self.__dict__.get(name)
+        if not rendered and raw:
+            markup_type = getattr(self,
+                markup.get_markup_type_field_name(field))
+            rendered = markup.render_markup(field, markup_type, raw)
+            setattr(self, rendered_name, rendered)
+        return mark_safe(rendered)
+
+    @property
+    def content_html(self):
+        return self._get_rendered_markup('content')
+
+    @property
+    def teaser_html(self):
+        return self._get_rendered_markup('teaser')
 
     @models.permalink
     def get_absolute_url(self):
@@ -133,38 +432,261 @@ class Post(models.Model):
         return (view_names[self.is_published], (), {'slug': self.slug})
 
     def save(self, **kwargs):
+        # following reads must see the changes, see ``vk.routing``
+        vk.routing.pin()
         self.teaser.markup_type = self.content.markup_type
         if self.is_published and not self.date_published:
             self.date_published = datetime.datetime.now()
-        super(Post, self).save(**kwargs)
+        if self.is_published or not self.date_scheduled:
+            self.date_scheduled = None
+            self.scheduled_by = None
+        if not self.slug:
+            self.slug = get_unique_slug(self.__class__, self.title, self.pk)
+        if self.pk is not None or kwargs.get('force_update'):
+            return super(Post, self).save(**kwargs)
+        # rely on unique constraints and retry insert with regenerated values
+        # instead of checking uniqueness before insert
+        using = kwargs.get('using') or router.db_for_write(self.__class__,
+            instance=self)
+        for attempt in range(MAX_SAVE_ATTEMPTS):
+            sid = transaction.savepoint(using=using)
+            try:
+                super(Post, self).save(**kwargs)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid, using=using)
+                if (attempt + 1 == MAX_SAVE_ATTEMPTS or self.pk is not None or
+                        not self._regenerate_unique_values(using)):
+                    raise
+            else:
+                transaction.savepoint_commit(sid, using=using)
+                return
+
+    def _regenerate_unique_values(self, using):
+        """ Regenerate unique values taken by other posts. Return ``False``
+            if all of them are unique.
+        """
+        qs = self.__class__._default_manager.using(using)
+        regenerated = False
+        if qs.filter(uid=self.uid).exists():
+            self.uid = generate_uid()
+            regenerated = True
+        if qs.filter(slug=self.slug).exists():
+            self.slug = get_unique_slug(self.__class__, self.title)
+            regenerated = True
+        return regenerated
 
     def publish(self):
         self.is_published = True
         self.save()
+        if DEFERRED_PERMISSIONS:
+            # permissions are propagated by task enqueued on save
+            return
         # TODO(sprymak): get rid of external dependencies
         # we must assign permissions to ANONYMOUS explicitly while there is no
         # way to assign roles to Anonymous user on system-wide level
         # (AnonymousHasNewsReaderRole test should pass).
-        import vk
-        vk.security.grant_permission(Operations.INDEX_POST,
-            [Roles.READER, vk.security.Roles.ANONYMOUS], self)
-        vk.security.grant_permission(Operations.GET_POST,
-            [Roles.READER, vk.security.Roles.ANONYMOUS], self)
+        vk.news.grant_published_permissions([self])
 
     def recall(self):
         self.is_published = False
         self.save()
-        import vk
-        vk.security.revoke_permission(Operations.INDEX_POST,
-            [Roles.READER, vk.security.Roles.ANONYMOUS], self)
-        vk.security.revoke_permission(Operations.GET_POST,
-            [Roles.READER, vk.security.Roles.ANONYMOUS], self)
+        if DEFERRED_PERMISSIONS:
+            return
+        vk.news.revoke_published_permissions([self])
+
+
+class PostGrant(models.Model):
+    """ Denormalized index of object level permissions granted on posts.
+        Maintained by ``vk.security`` grant and revoke functions, see
+        ``apps.news.visibility``.
+    """
+    post = models.ForeignKey(Post, related_name='grants')
+    operation = models.CharField(max_length=100)
+    role = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = ('operation', 'role', 'post')
+
+
+class PostRoleAssignment(models.Model):
+    """ Denormalized index of object level roles assigned to security
+        subjects on posts. Maintained by ``vk.security.assign_roles``, see
+        ``apps.news.visibility``.
+    """
+    post = models.ForeignKey(Post, related_name='role_assignments')
+    role = models.CharField(max_length=100)
+    subject_type = models.ForeignKey(ContentType)
+    subject_id = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('subject_type', 'subject_id', 'role', 'post')
+
+
+class PublishedTagCountManager(models.Manager):
+
+    def get_tag_ids(self, pks):
+        """ Return set of ids of tags posts with primary keys ``pks`` are
+            tagged with.
+        """
+        return set(TaggedItem.objects.filter(object_id__in=list(pks),
+            content_type=ContentType.objects.get_for_model(Post)
+        ).values_list('tag', flat=True))
+
+    def update_for_tags(self, tag_ids):
+        """ Recount published posts tagged with tags ``tag_ids``. """
+        tag_ids = list(tag_ids)
+        for chunk in chunks(tag_ids):
+            counts = dict((tag, 0) for tag in chunk)
+            counts.update(TaggedItem.objects.filter(tag__in=chunk,
+                content_type=ContentType.objects.get_for_model(Post),
+                object_id__in=Post.objects.published().values_list('pk',
+                    flat=True)
+            ).values_list('tag').annotate(models.Count('pk')))
+            existing = set(self.filter(tag__in=chunk).values_list('tag',
+                flat=True))
+            for tag, count in counts.items():
+                if tag in existing:
+                    self.filter(tag=tag).update(count=count)
+                elif count:
+                    self.create(tag_id=tag, count=count)
+
+    def update_for_posts(self, pks):
+        """ Recount published posts tagged with tags of posts ``pks``. """
+        self.update_for_tags(self.get_tag_ids(pks))
+
+    def rebuild(self):
+        """ Recount published posts for all tags. """
+        self.all().delete()
+        self.update_for_tags(Tag.objects.values_list('pk', flat=True))
+
+
+class PublishedTagCount(models.Model):
+    """ Number of published posts tagged with tag. Kept up to date on post
+        save, delete, publish and recall for affected tags only.
+    """
+    tag = models.OneToOneField(Tag, related_name='published_post_count')
+    count = models.PositiveIntegerField(default=0, db_index=True)
+
+    objects = PublishedTagCountManager()
+
+
+class PermissionTaskManager(models.Manager):
+
+    def enqueue(self, pks):
+        """ Queue propagation of permissions of posts with primary keys
+            ``pks``. Posts have single task at most: repeated toggles of
+            queued post just move its ``date_queued`` forward.
+        """
+        now = datetime.datetime.now()
+        using = router.db_for_write(self.model)
+        for chunk in chunks(list(pks)):
+            qs = self.using(using).filter(post__in=chunk)
+            qs.update(date_queued=now)
+            queued = set(qs.values_list('post', flat=True))
+            for pk in chunk:
+                if pk in queued:
+                    continue
+                sid = transaction.savepoint(using=using)
+                try:
+                    self.using(using).create(post_id=pk, date_queued=now)
+                except IntegrityError:
+                    # queued concurrently, worker will see current state
+                    transaction.savepoint_rollback(sid, using=using)
+                else:
+                    transaction.savepoint_commit(sid, using=using)
+        tasks.notify()
+
+
+class PermissionTask(models.Model):
+    """ Pending propagation of post permissions and visibility index, see
+        ``apps.news.tasks``. Task does not hold desired state, worker syncs
+        permissions with current state of the post.
+    """
+    post = models.OneToOneField(Post, related_name='permission_task')
+    date_queued = models.DateTimeField(db_index=True)
+
+    objects = PermissionTaskManager()
 
 
 def _news_post_post_save(sender, instance, created, **kwargs):
-    import vk
-    vk.security.assign_roles(Roles.AUTHOR, instance.author, instance)
-    vk.security.grant_permission(Operations.INDEX_POST,
-        [Roles.AUTHOR, Roles.MODERATOR], instance)
+    # author must be able to work with the post right away, so only grants
+    # depending on publication state are deferred
+    vk.news.assign_post_permissions([instance])
+    if DEFERRED_PERMISSIONS:
+        PermissionTask.objects.enqueue([instance.pk])
 
 models.signals.post_save.connect(_news_post_post_save, sender=Post)
+
+
+def _news_post_changed(sender, **kwargs):
+    caching.touch()
+
+models.signals.post_save.connect(_news_post_changed, sender=Post)
+models.signals.post_delete.connect(_news_post_changed, sender=Post)
+posts_published.connect(_news_post_changed, sender=Post)
+posts_recalled.connect(_news_post_changed, sender=Post)
+
+
+def _news_post_init(sender, instance, **kwargs):
+    # remember loaded slug to invalidate cached page of renamed post
+    instance._loaded_slug = instance.__dict__.get('slug')
+
+
+def _news_post_invalidated(sender, instance, **kwargs):
+    caching.invalidate_posts(set([instance.slug, instance._loaded_slug]) -
+        set([None, '']), instance.site_id)
+    instance._loaded_slug = instance.slug
+
+
+def _news_posts_invalidated(sender, pks, **kwargs):
+    for chunk in chunks(pks):
+        slugs = {}
+        for slug, site_id in Post.objects.filter(pk__in=chunk).values_list(
+                'slug', 'site'):
+            slugs.setdefault(site_id, []).append(slug)
+        for site_id, site_slugs in slugs.items():
+            caching.invalidate_posts(site_slugs, site_id)
+
+models.signals.post_init.connect(_news_post_init, sender=Post)
+models.signals.post_save.connect(_news_post_invalidated, sender=Post)
+models.signals.post_delete.connect(_news_post_invalidated, sender=Post)
+posts_published.connect(_news_posts_invalidated, sender=Post)
+posts_recalled.connect(_news_posts_invalidated, sender=Post)
+
+
+def _news_post_pre_tagged(sender, instance, **kwargs):
+    # remember tags to recount them after tags have been changed or post has
+    # been deleted
+    if instance.pk is not None:
+        instance._old_tag_ids = PublishedTagCount.objects.get_tag_ids(
+            [instance.pk])
+
+
+def _news_post_tagged(sender, instance, **kwargs):
+    tag_ids = getattr(instance, '_old_tag_ids', set())
+    if kwargs.get('signal') is models.signals.post_save:
+        tag_ids |= PublishedTagCount.objects.get_tag_ids([instance.pk])
+    PublishedTagCount.objects.update_for_tags(tag_ids)
+
+models.signals.pre_save.connect(_news_post_pre_tagged, sender=Post)
+models.signals.pre_delete.connect(_news_post_pre_tagged, sender=Post)
+models.signals.post_save.connect(_news_post_tagged, sender=Post)
+models.signals.post_delete.connect(_news_post_tagged, sender=Post)
+
+
+def _news_post_indexed(sender, instance, **kwargs):
+    search.get_backend(sender).index([instance])
+
+
+def _news_post_unindexed(sender, instance, **kwargs):
+    search.get_backend(sender).remove([instance.pk])
+
+models.signals.post_save.connect(_news_post_indexed, sender=Post)
+models.signals.post_delete.connect(_news_post_unindexed, sender=Post)
+
+
+def _news_post_syncdb(sender, created_models, **kwargs):
+    if Post in created_models:
+        search.get_backend(Post).install()
+
+models.signals.post_syncdb.connect(_news_post_syncdb)
@@ -0,0 +1,90 @@
+import base64
+import binascii
+import datetime
+import operator
+from functools import reduce
+from django.db import connections
+from django.db.models import Q
+
+# Keyset (cursor) pagination of news posts. Posts are ordered by
+# (date_published, date_created, id) descending, which matches
+# ``Post.Meta.ordering``. The cursor encodes the sort key of the last post on
+# a page and the next page starts right after it, so deep pages cost the
+# same as the first one.
+ORDERING = ('-date_published', '-date_created', '-pk')
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _format_datetime(value):
+    if value is None:
+        return ''
+    return value.strftime(DATETIME_FORMAT)
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, DATETIME_FORMAT)
+
+
+def encode_cursor(post):
+    """ Return cursor pointing right after ``post``. """
+    value = '|'.join([_format_datetime(post.date_published),
+        _format_datetime(post.date_created), str(post.pk)])
+    return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """ Return ``(date_published, date_created, pk)`` tuple encoded in
+        cursor. Raise ``ValueError`` if cursor is malformed.
+    """
+    try:
+        value = base64.urlsafe_b64decode(str(cursor)).decode('ascii')
+        date_published, date_created, pk = value.split('|')
+        return (_parse_datetime(date_published),
+            _parse_datetime(date_created), int(pk))
+    except (TypeError, UnicodeError, binascii.Error):
+        raise ValueError("Malformed cursor: %r" % cursor)
+
+
+def _nulls_first(queryset):
+    # NULL values are the largest ones in PostgreSQL and Oracle, so they go
+    # first in descending order
+    vendor = getattr(connections[queryset.db], 'vendor', '')
+    return vendor in ('postgresql', 'oracle')
+
+
+def _after(queryset, date_published, date_created, pk):
+    """ Return condition selecting posts following given sort key. """
+    created = Q(date_created__lt=date_created) | Q(
+        date_created=date_created, pk__lt=pk)
+    if date_published is None:
+        conditions = [Q(date_published__isnull=True) & created]
+        if _nulls_first(queryset):
+            conditions.append(Q(date_published__isnull=False))
+    else:
+        conditions = [Q(date_published__lt=date_published),
+            Q(date_published=date_published) & created]
+        if not _nulls_first(queryset):
+            conditions.append(Q(date_published__isnull=True))
+    return reduce(operator.or_, conditions)
+
+
+def get_page(queryset, cursor=None, limit=10):
+    """ Return ``(posts, next_cursor)`` tuple, where ``posts`` is the list of
+        at most ``limit`` posts following ``cursor`` and ``next_cursor`` is
+        the cursor of the next page or ``None`` if this page is the last one.
+
+        :param queryset: ``Post`` query set.
+        :param cursor: cursor returned for the previous page or ``None`` to
+            get the first page. ``ValueError`` is raised if it is malformed.
+    """
+    qs = queryset.order_by(*ORDERING)
+    if cursor:
+        qs = qs.filter(_after(qs, *decode_cursor(cursor)))
+    posts = list(qs[:limit + 1])
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(posts[-1])
+    return posts, next_cursor
@@ -0,0 +1,177 @@
+""" Full-text search over posts.
+
+    Title, rendered content text, tags and author name of every post are
+    kept in a search index updated on post save and delete. The index is
+    implemented by backends: ``SQLiteBackend`` uses FTS5 virtual table,
+    ``SimpleBackend`` is a fallback for other databases which scans posts
+    table. Backend is chosen by database vendor unless
+    ``NEWS_SEARCH_BACKEND`` setting holds dotted path of backend class.
+
+    Use ``news_rebuild_search`` command to build index of existing posts.
+"""
+import operator
+import re
+from functools import reduce
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils.html import strip_tags
+from django.utils.importlib import import_module
+
+
+BACKEND = getattr(settings, 'NEWS_SEARCH_BACKEND', None)
+# maximum number of posts indexed in single transaction on rebuild
+REBUILD_CHUNK_SIZE = 500
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def get_terms(query):
+    """ Split search query into words. """
+    return _WORD_RE.findall(query or '')
+
+
+def get_document(post):
+    """ Return dictionary of texts indexed for post. """
+    author = post.author
+    return {
+        'title': post.title,
+        'content': strip_tags(post.content_html),
+        'tags': ' '.join(post.tag_list),
+        'author': u' '.join([author.username, author.get_full_name()]),
+    }
+
+
+class SearchBackend(object):
+    """ Base class of search backends. ``using`` is alias of database the
+        posts are stored in.
+    """
+
+    def __init__(self, using):
+        self.using = using
+
+    def install(self):
+        """ Create index storage if it does not exist. """
+
+    def index(self, posts):
+        """ Add posts to index or update their entries. """
+
+    def remove(self, pks):
+        """ Remove posts with primary keys ``pks`` from index. """
+
+    def clear(self):
+        """ Remove all posts from index. """
+
+    def search(self, queryset, terms):
+        """ Filter posts ``queryset`` by words ``terms``, all of which must
+            be found in post.
+        """
+        raise NotImplementedError
+
+
+class SimpleBackend(SearchBackend):
+    """ Search by ``icontains`` lookups, does not keep any index. """
+
+    fields = ('title', 'tags', 'content', 'author__username',
+        'author__first_name', 'author__last_name')
+
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(reduce(operator.or_,
+                [Q(**{'%s__icontains' % field: term})
+                    for field in self.fields]))
+        return queryset
+
+
+class SQLiteBackend(SearchBackend):
+    """ Index in SQLite FTS5 virtual table, rowid of entries are primary
+        keys of posts. Words are matched by prefix.
+    """
+
+    table = 'news_post_fts'
+
+    def execute(self, sql, params=()):
+        cursor = connections[self.using].cursor()
+        cursor.execute(sql, params)
+        return cursor
+
+    def install(self):
+        self.execute('CREATE VIRTUAL TABLE IF NOT EXISTS %s USING '
+            'fts5(title, content, tags, author)' % self.table)
+
+    def index(self, posts):
+        for post in posts:
+            document = get_document(post)
+            self.execute('DELETE FROM %s WHERE rowid = %%s' % self.table,
+                [post.pk])
+            self.execute('INSERT INTO %s (rowid, title, content, tags, '
+                'author) VALUES (%%s, %%s, %%s, %%s, %%s)' % self.table,
+                [post.pk, document['title'], document['content'],
+                    document['tags'], document['author']])
+        transaction.commit_unless_managed(using=self.using)
+
+    def remove(self, pks):
+        for pk in pks:
+            self.execute('DELETE FROM %s WHERE rowid = %%s' % self.table,
+                [pk])
+        transaction.commit_unless_managed(using=self.using)
+
+    def clear(self):
+        self.execute('DELETE FROM %s' % self.table)
+        transaction.commit_unless_managed(using=self.using)
+
+    def search(self, queryset, terms):
+        # quote words to escape FTS query syntax
+        match = ' '.join('"%s"*' % term for term in terms)
+        opts = queryset.model._meta
+        qn = connections[self.using].ops.quote_name
+        return queryset.extra(where=['%s.%s IN (SELECT rowid FROM %s '
+            'WHERE %s MATCH %%s)' % (qn(opts.db_table), qn(opts.pk.column),
+                self.table, self.table)], params=[match])
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteBackend,
+}
+
+_backends = {}
+
+
+def get_backend(model):
+    """ Return search backend of database ``model`` objects are stored in.
+    """
+    using = router.db_for_write(model)
+    if using not in _backends:
+        if BACKEND:
+            module, name = BACKEND.rsplit('.', 1)
+            backend_class = getattr(import_module(module), name)
+        else:
+            backend_class = VENDOR_BACKENDS.get(connections[using].vendor,
+                SimpleBackend)
+        _backends[using] = backend_class(using)
+    return _backends[using]
+
+
+def search(queryset, query):
+    """ Filter posts ``queryset`` by search query. Ordering of queryset is
+        preserved. Empty query matches nothing.
+    """
+    terms = get_terms(query)
+    if not terms:
+        # unlike none() keeps PostQuerySet methods available
+        return queryset.filter(pk__in=[])
+    return get_backend(queryset.model).search(queryset, terms)
+
+
+def rebuild(posts):
+    """ Create index if needed and fill it with ``posts`` queryset. """
+    backend = get_backend(posts.model)
+    backend.install()
+    with transaction.commit_on_success(using=backend.using):
+        backend.clear()
+    pks = list(posts.values_list('pk', flat=True))
+    for i in range(0, len(pks), REBUILD_CHUNK_SIZE):
+        with transaction.commit_on_success(using=backend.using):
+            backend.index(posts.model._default_manager.select_related(
+                'author').filter(pk__in=pks[i:i + REBUILD_CHUNK_SIZE]))
+    return len(pks)
@@ -0,0 +1,5 @@
+-- "Latest published posts of the site" is a range scan over this index in
+-- the order of Post.Meta.ordering and the keyset pagination order.
+CREATE INDEX news_post_site_published ON news_post (site_id, is_published, date_published, date_created, id);
+-- Due scheduled posts, see PostManager.publish_due.
+CREATE INDEX news_post_scheduled ON news_post (is_published, date_scheduled);
@@ -0,0 +1,67 @@
+""" Deferred propagation of post permissions.
+
+    With ``NEWS_DEFERRED_PERMISSIONS`` enabled publishing and recalling posts
+    updates post rows only and queues ``PermissionTask`` for every affected
+    post (saved posts still get the author role right away). Permissions
+    and visibility index are brought in line with current state of queued
+    posts by ``vk.news.drain_permission_tasks``, which is called by the
+    ``news_drain_tasks`` management command (e.g. from cron) or, with
+    ``NEWS_TASK_WORKER = 'thread'``, by a daemon thread of every process.
+"""
+import logging
+import threading
+from django.conf import settings
+from django.db import connection
+
+import vk
+
+
+# 'thread' to drain queue by in-process worker thread, None to rely on
+# ``news_drain_tasks`` command
+WORKER = getattr(settings, 'NEWS_TASK_WORKER', None)
+# seconds worker thread waits for new tasks before polling the queue
+WORKER_POLL_INTERVAL = getattr(settings, 'NEWS_TASK_WORKER_POLL_INTERVAL', 5)
+
+logger = logging.getLogger(__name__)
+
+
+class Worker(threading.Thread):
+    """ Daemon thread draining task queue whenever it is notified or poll
+        interval is elapsed.
+    """
+
+    def __init__(self):
+        super(Worker, self).__init__(name='news-permission-tasks')
+        self.daemon = True
+        self.event = threading.Event()
+
+    def run(self):
+        while True:
+            self.event.wait(WORKER_POLL_INTERVAL)
+            self.event.clear()
+            try:
+                vk.news.drain_permission_tasks()
+            except Exception:
+                logger.exception('Failed to drain permission tasks')
+            finally:
+                # the thread has its own connection, do not keep it open
+                connection.close()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def notify():
+    """ Wake up worker thread, starting it on first call. Does nothing unless
+        ``NEWS_TASK_WORKER`` is ``'thread'``. Tasks queued in uncommitted
+        transaction are picked up on the next poll.
+    """
+    global _worker
+    if WORKER != 'thread':
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = Worker()
+            _worker.start()
+    _worker.event.set()
@@ -0,0 +1,200 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+import rbac
+import vk
+from vk import routing
+
+from . import caching
+from . import models
+from . import search
+
+
+class SearchTest(TestCase):
+
+    def assertMatchesNothing(self, query):
+        posts = search.search(models.Post.objects.published(), query)
+        self.assertTrue(isinstance(posts, models.PostQuerySet))
+        self.assertEqual(list(posts.summaries()), [])
+        self.assertEqual(list(posts.on_site().summaries()), [])
+
+    def test_empty_query(self):
+        self.assertMatchesNothing('')
+        self.assertMatchesNothing(None)
+
+    def test_punctuation_only_query(self):
+        self.assertMatchesNothing('?!. -- ,')
+
+    def test_search_view_with_punctuation_only_query(self):
+        response = self.client.get(reverse('news_search'), {'q': '?!'})
+        self.assertNotEqual(response.status_code, 500)
+
+
+class ReplicaRoutingTest(TestCase):
+    """ Routing with a replica configured, e.g. with two SQLite databases::
+
+            DATABASES = {
+                'default': {'ENGINE': 'django.db.backends.sqlite3', ...},
+                'replica': {'ENGINE': 'django.db.backends.sqlite3', ...,
+                    'TEST_MIRROR': 'default'},
+            }
+    """
+
+    def setUp(self):
+        self.read_databases = routing.READ_DATABASES
+        routing.READ_DATABASES = ('replica',)
+        routing.unpin()
+        self.router = routing.ReplicaRouter()
+        self.middleware = routing.StickinessMiddleware()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        routing.READ_DATABASES = self.read_databases
+        routing.unpin()
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(models.Post), 'replica')
+
+    def test_writes_go_to_write_database(self):
+        self.assertEqual(self.router.db_for_write(models.Post),
+            routing.WRITE_DATABASE)
+
+    def test_reads_after_write_go_to_write_database(self):
+        author = User.objects.create(username='author')
+        models.Post(title='Title', author=author, content='Text').save()
+        self.assertEqual(self.router.db_for_read(models.Post),
+            routing.WRITE_DATABASE)
+
+    def test_pinned_block_does_not_leak(self):
+        with routing.pinned():
+            self.assertEqual(self.router.db_for_read(models.Post),
+                routing.WRITE_DATABASE)
+            routing.pin()
+        self.assertEqual(self.router.db_for_read(models.Post), 'replica')
+
+    def test_reads_stick_to_write_database_after_write(self):
+        request = self.factory.post('/')
+        self.middleware.process_request(request)
+        routing.pin()
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertTrue(routing.STICKY_COOKIE in response.cookies)
+        self.assertEqual(self.router.db_for_read(models.Post), 'replica')
+
+        request = self.factory.get('/')
+        request.COOKIES[routing.STICKY_COOKIE] = response.cookies[
+            routing.STICKY_COOKIE].value
+        self.middleware.process_request(request)
+        self.assertEqual(self.router.db_for_read(models.Post),
+            routing.WRITE_DATABASE)
+        # reads do not extend stickiness
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertFalse(routing.STICKY_COOKIE in response.cookies)
+        self.assertEqual(self.router.db_for_read(models.Post), 'replica')
+
+
+class AdminTest(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com',
+            'admin')
+        self.client.login(username='admin', password='admin')
+        self.post = models.Post(title='Title', author=admin, content='Text')
+        self.post.save()
+
+    def test_delete_action_runs_post_handlers(self):
+        cache = caching.get_news_cache()
+        key = caching.get_post_key(self.post.slug)
+        cache.set(key, self.post.date_updated)
+        response = self.client.post(
+            reverse('admin:news_post_changelist'), {
+                'action': 'delete_selected',
+                '_selected_action': [self.post.pk],
+                'post': 'yes',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(models.Post.objects.filter(
+            pk=self.post.pk).exists())
+        # cached post version is dropped by post_delete handler
+        self.assertEqual(cache.get(key), None)
+
+
+def create_user(username):
+    """ Create user with profile, which security subjects are read from. """
+    user = User.objects.create(username=username)
+    vk.security._get_profile_model()._default_manager.get_or_create(
+        user=user)
+    return user
+
+
+class PostSecurityPolicyTest(TestCase):
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.moderator = create_user('moderator')
+        self.posts = []
+        for i in range(20):
+            post = models.Post(title='Post %i' % i, author=self.author,
+                content='Text')
+            post.save()
+            self.posts.append(post)
+        vk.security.assign_roles(models.Roles.MODERATOR, self.moderator,
+            self.posts[0])
+        self.policy = vk.security.get_policy(models.Post)
+
+    def test_user_roles_include_object_roles(self):
+        roles = self.policy.get_user_roles(self.moderator, self.posts[:2])
+        self.assertTrue(models.Roles.MODERATOR in roles[self.posts[0]])
+        self.assertFalse(models.Roles.MODERATOR in roles[self.posts[1]])
+
+    def test_user_roles_query_count_does_not_depend_on_posts(self):
+        # memoize roles on model level and security subjects of user
+        self.policy.get_user_roles(self.moderator, self.posts[:1])
+        with self.assertNumQueries(1):
+            self.policy.get_user_roles(self.moderator, self.posts[:1])
+        with self.assertNumQueries(1):
+            self.policy.get_user_roles(self.moderator, self.posts)
+
+    def assertFilterMatchesChecks(self, user):
+        self.posts[1].publish()
+        operation = models.Operations.INDEX_POST
+        filtered = set(vk.news.get_posts_for_user(user, operation)
+            .values_list('pk', flat=True))
+        checked = set(post.pk for post in models.Post.objects.all()
+            if vk.security.check_permission(user, operation, post))
+        self.assertEqual(filtered, checked)
+        return filtered
+
+    def test_filter_matches_checks_for_author(self):
+        filtered = self.assertFilterMatchesChecks(self.author)
+        self.assertEqual(filtered, set(post.pk for post in self.posts))
+
+    def test_filter_matches_checks_for_moderator_of_post(self):
+        filtered = self.assertFilterMatchesChecks(self.moderator)
+        self.assertEqual(filtered, set([self.posts[0].pk, self.posts[1].pk]))
+
+    def test_filter_matches_checks_for_anonymous(self):
+        filtered = self.assertFilterMatchesChecks(AnonymousUser())
+        self.assertEqual(filtered, set([self.posts[1].pk]))
+
+    def get_permission_rows(self, post):
+        from rbac.models import ObjectPermission
+        return set(ObjectPermission.objects.filter(
+            content_type=ContentType.objects.get_for_model(models.Post),
+            object_id=post.pk).values_list('operation__name', 'roles__name'))
+
+    def test_bulk_grant_matches_rbac_grant(self):
+        from rbac.models import Operation, Role
+        operation = 'test_operation'
+        roles = ['test_role', models.Roles.MODERATOR]
+        # operation and test role do not exist yet and are created in bulk
+        vk.security.grant_permission_bulk(operation, roles, self.posts[:2])
+        for post in self.posts[2:4]:
+            rbac.grant_permission(operation, roles, post)
+        expected = set((operation, role) for role in roles)
+        for post in self.posts[:4]:
+            self.assertEqual(self.get_permission_rows(post), expected)
+        self.assertEqual(Operation.objects.filter(name=operation).count(), 1)
+        self.assertEqual(Role.objects.filter(name='test_role').count(), 1)
@@ -3,11 +3,15 @@ from . import feeds
 
 default_feeds = {
     'latest': feeds.LatestPosts,
+    'tag': feeds.TaggedPosts,
 }
 
 urlpatterns = patterns('news.views',
     url(r'^$', 'index', name='news_index'),
+    url(r'^posts\.json$', 'index_json', name='news_index_json'),
     url(r'^add$', 'add', name='news_post_add'),
+    url(r'^search$', 'search_posts', name='news_search'),
+    url(r'^tag/(?P<tag>[^/]+)$', 'tag', name='news_tag'),
     url(r'^(?P<slug>[\w-]+)$', 'detail', name='news_post_detail'),
     url(r'^(?P<slug>[\w-]+)/edit$', 'edit', name='news_post_edit'),
     url(r'^(?P<slug>[\w-]+)/preview$', 'preview', name='news_post_preview'),
@@ -15,6 +19,6 @@ urlpatterns = patterns('news.views',
     url(r'^(?P<slug>[\w-]+)/publish$', 'publish', name='news_post_publish'),
     url(r'^(?P<slug>[\w-]+)/recall$', 'recall', name='news_post_recall'),
 )
-urlpatterns += patterns('django.contrib.syndication.views',
-    url(r'^feeds/(?P<url>.*)/$', 'feed', {'feed_dict': default_feeds}, name="news_feeds"),
+urlpatterns += patterns('',
+    url(r'^feeds/(?P<url>.*)/$', feeds.feed, {'feed_dict': default_feeds}, name="news_feeds"),
 )
@@ -1,13 +1,27 @@
+import datetime
+from calendar import timegm
+from django import forms
 from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.forms.models import modelform_factory
-from django.utils.translation import ugettext_lazy as _
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.utils.hashcompat import md5_constructor
+from django.utils.http import http_date
+from django.utils.translation import get_language, ugettext_lazy as _
 from django.views import generic
 from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import condition
+from tagging.models import Tag
 from utils.django import reverse_lazy
 from utils.django.decorators import ajax_only, render_to_json
+import vk
+from vk.security import SecuredObjectMixin, permission_required
 
+from . import caching
 from . import models
+from . import pagination
+from . import search
 
 __all__ = [
     'add',
@@ -15,54 +29,262 @@ __all__ = [
     'detail',
     'edit',
     'index',
+    'index_json',
     'preview',
     'publish',
-    'recall'
+    'recall',
+    'search_posts',
+    'tag',
 ]
 
 POSTS_PER_PAGE = getattr(settings, "NEWS_POSTS_PER_PAGE", 10)
 
-PostForm = modelform_factory(models.Post,
-    fields=('title', 'teaser', 'content', 'tags'))
 
+class PostForm(forms.ModelForm):
+    """ Post form, scheduled publication date is editable only by users
+        allowed to publish the post (``can_schedule`` argument).
+    """
 
-class CreatePostView(generic.CreateView):
+    class Meta:
+        model = models.Post
+        fields = ('title', 'teaser', 'content', 'tags', 'date_scheduled')
+
+    def __init__(self, *args, **kwargs):
+        can_schedule = kwargs.pop('can_schedule', False)
+        super(PostForm, self).__init__(*args, **kwargs)
+        if not can_schedule:
+            del self.fields['date_scheduled']
+
+
+class PostFormMixin(object):
+    """ Mixin for views editing post with ``PostForm``. """
+
+    def get_form_kwargs(self):
+        kwargs = super(PostFormMixin, self).get_form_kwargs()
+        kwargs['can_schedule'] = vk.security.check_permission(
+            self.request.user, models.Operations.PUBLISH_POST,
+            self.object or models.Post)
+        return kwargs
+
+    def form_valid(self, form):
+        if 'date_scheduled' in form.changed_data:
+            form.instance.scheduled_by = self.request.user
+        return super(PostFormMixin, self).form_valid(form)
+
+
+class CreatePostView(PostFormMixin, generic.CreateView):
     model = models.Post
     form_class = PostForm
 
     def form_valid(self, form):
-        from pytils.translit import slugify
         from django.contrib import messages
         self.object = form.save(commit=False)
         self.object.author = self.request.user
-        # FIX: get_unique_slug(models.Post, form.cleaned_data["title"])
-        self.object.slug = slugify(form.cleaned_data["title"])
+        self.object.slug = models.get_unique_slug(models.Post,
+            form.cleaned_data["title"])
         messages.success(self.request, _("News post successfully created."))
         return super(self.__class__, self).form_valid(form)
 
 
+def get_user_posts_page(request, query=None, tag=None):
+    """ Return ``(posts, next_cursor)`` page of posts indexable by user,
+        starting after the cursor passed in ``cursor`` request argument.
+
+        :param query: full-text search query posts are filtered by.
+        :param tag: ``Tag`` posts are filtered by.
+    """
+    qs = vk.news.get_posts_for_user(request.user, 'news.index_post')
+    if query is not None:
+        qs = search.search(qs, query)
+    if tag is not None:
+        qs = qs.tagged(tag)
+    try:
+        return pagination.get_page(
+            qs.summaries(),
+            request.GET.get('cursor'), POSTS_PER_PAGE)
+    except ValueError:
+        raise Http404
+
+
 class UserPostsListView(generic.ListView):
     model = models.Post
-    paginate_by = POSTS_PER_PAGE
     template_name = 'news/post_list.html'
     context_object_name = 'post_list'
 
     def get_queryset(self):
-        import vk
-        return vk.news.get_posts_for_user(self.request.user,
-            'news.index_post')
+        posts, self.next_cursor = get_user_posts_page(self.request)
+        return posts
+
+    def get_context_data(self, **kwargs):
+        context = super(UserPostsListView, self).get_context_data(**kwargs)
+        context['next_cursor'] = self.next_cursor
+        if self.next_cursor:
+            params = self.request.GET.copy()
+            params['cursor'] = self.next_cursor
+            context['next_page_url'] = '%s?%s' % (self.request.path,
+                params.urlencode())
+        return context
+
+
+class SearchPostsListView(UserPostsListView):
+    """ Posts indexable by user matching query passed in ``q`` argument. """
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        posts, self.next_cursor = get_user_posts_page(self.request,
+            self.query)
+        return posts
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchPostsListView, self).get_context_data(**kwargs)
+        context['query'] = self.query
+        return context
+
+
+class TagPostsListView(UserPostsListView):
+    """ Posts indexable by user tagged with tag passed in ``tag`` argument.
+    """
+
+    def get_queryset(self):
+        self.tag = get_object_or_404(Tag, name=self.kwargs['tag'])
+        posts, self.next_cursor = get_user_posts_page(self.request,
+            tag=self.tag)
+        return posts
+
+    def get_context_data(self, **kwargs):
+        context = super(TagPostsListView, self).get_context_data(**kwargs)
+        context['tag'] = self.tag
+        return context
+
+
+def _make_etag(request, *bits):
+    """ Return ETag of page depending on ``bits``, user and language. """
+    key = u':'.join([unicode(bit) for bit in bits] + [
+        unicode(request.user.pk), get_language()])
+    return md5_constructor(key.encode('utf-8')).hexdigest()
+
+
+def get_post_updated(request, slug):
+    """ Return ``date_updated`` of published post, ``None`` if there is no
+        such post. Value is cached until post is changed.
+    """
+    if not hasattr(request, '_news_post_updated'):
+        cache = caching.get_news_cache()
+        key = caching.get_post_key(slug)
+        date_updated = cache.get(key)
+        if date_updated is None:
+            # cached until the next change, so do not cache replica lag
+            date_updated = list(models.Post.objects.using(
+                vk.routing.get_write_database()).on_site().published(
+                ).filter(slug=slug).values_list('date_updated', flat=True)[:1])
+            date_updated = date_updated and date_updated[0] or False
+            cache.set(key, date_updated, caching.PAGE_TIMEOUT)
+        request._news_post_updated = date_updated or None
+    return request._news_post_updated
+
+
+def _detail_etag(request, slug):
+    date_updated = get_post_updated(request, slug)
+    return date_updated and _make_etag(request, slug,
+        date_updated.isoformat())
+
+
+def _detail_last_modified(request, slug):
+    return get_post_updated(request, slug)
+
+
+def _index_etag(request):
+    # index depends on permissions of the user on all posts
+    return _make_etag(request, request.get_full_path(), caching.get_stamp(),
+        vk.security.get_permissions_version(models.Post))
+
+
+def _index_last_modified(request):
+    return datetime.datetime.fromtimestamp(int(max(caching.get_stamp(),
+        vk.security.get_permissions_version(models.Post))))
+
+
+class SecuredDeleteView(SecuredObjectMixin, generic.DeleteView):
+    pass
+
+
+class SecuredDetailView(SecuredObjectMixin, generic.DetailView):
+    pass
+
+
+class SecuredUpdateView(SecuredObjectMixin, generic.UpdateView):
+    pass
+
+
+class UpdatePostView(PostFormMixin, SecuredUpdateView):
+    pass
 
 
 add = CreatePostView.as_view()
-delete = generic.DeleteView.as_view(model=models.Post,
+delete = SecuredDeleteView.as_view(model=models.Post,
     success_url=reverse_lazy('news_index'))
-detail = generic.DetailView.as_view(model=models.Post,
+_detail = generic.DetailView.as_view(model=models.Post,
     context_object_name='post',
-    queryset=models.Post.objects.published())
-edit = generic.UpdateView.as_view(model=models.Post, form_class=PostForm)
-index = UserPostsListView.as_view()
-preview = generic.DetailView.as_view(model=models.Post,
-    context_object_name='post')
+    queryset=models.Post.objects.on_site().published().for_detail())
+edit = UpdatePostView.as_view(model=models.Post, form_class=PostForm)
+index = condition(etag_func=_index_etag,
+    last_modified_func=_index_last_modified)(UserPostsListView.as_view())
+
+
+@condition(etag_func=_detail_etag, last_modified_func=_detail_last_modified)
+def detail(request, slug):
+    """ Published post page. Pages rendered for anonymous users are cached
+        until the post is changed, so they are served without queries.
+    """
+    date_updated = get_post_updated(request, slug)
+    if date_updated is None:
+        raise Http404
+    if request.user.is_authenticated():
+        return _detail(request, slug=slug)
+    cache = caching.get_news_cache()
+    key = caching.get_page_key(slug, date_updated)
+    cached = cache.get(key)
+    if cached is not None:
+        return caching.unpack_response(cached)
+    response = _detail(request, slug=slug)
+    response.render()
+    if response.status_code == 200:
+        # headers added by decorators and middleware later are cached too
+        response['Last-Modified'] = http_date(
+            timegm(date_updated.utctimetuple()))
+        patch_vary_headers(response, ('Cookie', 'Accept-Language'))
+        cache.set(key, caching.pack_response(response), caching.PAGE_TIMEOUT)
+    return response
+
+
+search_posts = SearchPostsListView.as_view()
+tag = TagPostsListView.as_view()
+preview = SecuredDetailView.as_view(model=models.Post,
+    context_object_name='post',
+    queryset=models.Post.objects.for_detail())
+
+
+@render_to_json
+def index_json(request):
+    """ Return page of posts indexable by user and cursor of the next page
+        (``null`` for the last one). Pass it in ``cursor`` argument to get
+        the next page.
+    """
+    posts, next_cursor = get_user_posts_page(request)
+    return {
+        'success': True,
+        'posts': [{
+            'title': post.title,
+            'slug': post.slug,
+            'url': post.get_absolute_url(),
+            'teaser': post.teaser_html,
+            'author': post.author_name,
+            'is_published': post.is_published,
+            'date_published': post.date_published and
+                post.date_published.isoformat(),
+        } for post in posts],
+        'next': next_cursor,
+    }
 
 
 @ajax_only
@@ -70,11 +292,20 @@ preview = generic.DetailView.as_view(model=models.Post,
 @render_to_json
 def publish(request, slug, is_published=True):
     """Toggle post published state."""
-    from django.shortcuts import get_object_or_404
-    post = get_object_or_404(models.Post, slug=slug)
+    # read the post being changed from the write database, bulk publish
+    # and recall route the following reads there too (see ``vk.routing``)
+    write_db = vk.routing.get_write_database()
+    posts = models.Post.objects.using(write_db)
+    post = getattr(request, 'secured_object', None)
+    if not isinstance(post, models.Post) or post._state.db != write_db:
+        post = get_object_or_404(posts, slug=slug)
     if post.is_published != is_published:
+        rs = posts.filter(pk=post.pk)
+        if is_published:
+            rs.publish()
+        else:
+            rs.recall()
         post.is_published = is_published
-        post.save()
     view_name = ('news_post_publish', 'news_post_recall')[post.is_published]
     return {
         'success': True,
@@ -90,8 +321,6 @@ def recall(request, slug):
     return publish(request, slug, False)
 
 
-from vk.security import permission_required
-
 GET_POST_BY_SLUG = (models.Post, 'slug', 'slug')
 
 add = permission_required('news.add_post')(add)
@@ -0,0 +1,139 @@
+import operator
+from functools import reduce
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, Q
+
+import vk
+
+from . import models
+
+# Denormalized visibility index of posts. Object level permissions granted
+# on posts are kept in ``PostGrant`` and object level roles assigned on posts
+# in ``PostRoleAssignment``, so posts visible to a set of security subjects
+# and roles are selected with indexed joins instead of asking RBAC about
+# every single post.
+
+
+def _get_pks(posts):
+    return [getattr(post, 'pk', post) for post in posts]
+
+
+def add_grants(operation, roles, posts):
+    """ Index permission granted to roles on posts. """
+    for chunk in models.chunks(_get_pks(posts)):
+        existing = set(models.PostGrant.objects.filter(operation=operation,
+            role__in=roles, post__in=chunk).values_list('post', 'role'))
+        vk.security.bulk_insert(models.PostGrant,
+            ('post', 'operation', 'role'), [(pk, operation, role)
+                for pk in chunk for role in roles
+                    if (pk, role) not in existing])
+
+
+def remove_grants(operation, roles, posts):
+    """ Remove permission revoked from roles on posts from index. """
+    for chunk in models.chunks(_get_pks(posts)):
+        models.PostGrant.objects.filter(operation=operation, role__in=roles,
+            post__in=chunk).delete()
+
+
+def add_role_assignments(roles, subjects, post):
+    """ Index roles assigned to security subjects on post. """
+    for subject in subjects:
+        subject_type = ContentType.objects.get_for_model(subject)
+        for role in roles:
+            models.PostRoleAssignment.objects.get_or_create(post_id=post.pk,
+                role=role, subject_type=subject_type, subject_id=subject.pk)
+
+
+def get_assigned_roles(subjects, posts):
+    """ Return mapping of primary keys of posts to sets of roles assigned
+        on them to security subjects. Query is issued per chunk of posts.
+    """
+    result = {}
+    if not subjects:
+        return result
+    condition = _subjects_condition(subjects)
+    for chunk in models.chunks(_get_pks(posts)):
+        for post, role in models.PostRoleAssignment.objects.filter(condition,
+                post__in=chunk).values_list('post', 'role'):
+            result.setdefault(post, set()).add(role)
+    return result
+
+
+def _subjects_condition(subjects):
+    pks = {}
+    for subject in subjects:
+        subject_type = ContentType.objects.get_for_model(subject)
+        pks.setdefault(subject_type.pk, []).append(subject.pk)
+    return reduce(operator.or_, [Q(subject_type=subject_type,
+        subject_id__in=subject_pks)
+            for subject_type, subject_pks in pks.items()])
+
+
+def get_assigned_condition(subjects, roles):
+    """ Return condition selecting posts any of roles is assigned on to
+        security subjects.
+    """
+    return Q(pk__in=models.PostRoleAssignment.objects.filter(
+        _subjects_condition(subjects), role__in=roles).values('post'))
+
+
+def get_condition(operation, roles, subjects, model_roles=()):
+    """ Return condition selecting posts security subjects holding roles are
+        allowed to perform operation on.
+
+        :param roles: roles subjects hold on model level.
+        :param subjects: security subjects, see
+            ``vk.security.get_user_security_subjects``.
+        :param model_roles: roles operation is granted to on model level, so
+            subjects holding them on object level are allowed to perform
+            operation regardless of object level grants.
+    """
+    conditions = [Q(pk__in=models.PostGrant.objects.filter(
+        operation=operation, role__in=roles).values('post'))]
+    if subjects:
+        assignments = models.PostRoleAssignment.objects.filter(
+            _subjects_condition(subjects))
+        conditions.append(Q(pk__in=assignments.filter(
+            post__grants__operation=operation,
+            post__grants__role=F('role')).values('post')))
+        if model_roles:
+            conditions.append(Q(pk__in=assignments.filter(
+                role__in=model_roles).values('post')))
+    return reduce(operator.or_, conditions)
+
+
+def rebuild(posts, post_grants, published_post_grants):
+    """ Rebuild visibility index for posts from grants issued by news
+        application and post authors. Roles assigned on posts to subjects
+        other than authors are kept as is.
+
+        :param posts: ``Post`` query set.
+        :param post_grants: ``(operation, roles)`` pairs granted on every
+            post, see ``vk.news.POST_GRANTS``.
+        :param published_post_grants: ``(operation, roles)`` pairs granted
+            on published posts, see ``vk.news.PUBLISHED_POST_GRANTS``.
+    """
+    user_type = ContentType.objects.get_for_model(User)
+    values = list(posts.values_list('pk', 'author', 'is_published'))
+    count = 0
+    for chunk in models.chunks(values):
+        with transaction.commit_on_success():
+            pks = [pk for pk, author, is_published in chunk]
+            published = [pk for pk, author, is_published in chunk
+                if is_published]
+            models.PostGrant.objects.filter(post__in=pks).delete()
+            models.PostRoleAssignment.objects.filter(post__in=pks,
+                role=models.Roles.AUTHOR, subject_type=user_type).delete()
+            for operation, roles in post_grants:
+                add_grants(operation, roles, pks)
+            for operation, roles in published_post_grants:
+                add_grants(operation, roles, published)
+            for pk, author, is_published in chunk:
+                models.PostRoleAssignment.objects.create(post_id=pk,
+                    role=models.Roles.AUTHOR, subject_type=user_type,
+                    subject_id=author)
+        count += len(chunk)
+    return count
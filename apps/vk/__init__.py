@@ -1,2 +1,27 @@
-from . import news
-from . import security
+""" Submodules are imported on first attribute access, so ``import vk``
+    does not pull in RBAC, models or news application until they are used.
+"""
+import sys
+import types
+
+SUBMODULES = ('instrumentation', 'news', 'routing', 'security', 'signals')
+
+
+class LazyPackage(types.ModuleType):
+
+    def __getattr__(self, name):
+        # globals of this module may be cleared once it is replaced in
+        # sys.modules, so only attributes of the package are used here
+        if name not in self.SUBMODULES:
+            raise AttributeError(name)
+        from django.utils.importlib import import_module
+        # importing submodule sets it as attribute of the package
+        return import_module('%s.%s' % (self.__name__, name))
+
+
+_package = LazyPackage(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+# keep the replaced module alive, Python 2 clears globals of collected
+# modules
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
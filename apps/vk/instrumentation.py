@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends import BaseDatabaseWrapper
+from django.utils.importlib import import_module
+
+# Lightweight instrumentation of security and news hot paths. Instrumented
+# functions record number of calls, cumulative (inclusive) time and number
+# of queries issued to any database per thread, and
+# ``InstrumentationMiddleware`` passes collected statistics of every request
+# to configured sinks. When disabled, neither functions nor database cursors
+# are wrapped at all.
+ENABLED = getattr(settings, 'VK_INSTRUMENTATION', False)
+SINKS = getattr(settings, 'VK_INSTRUMENTATION_SINKS',
+    ('vk.instrumentation.LoggingSink',))
+HEADER = 'X-VK-Instrumentation'
+
+_local = threading.local()
+
+
+def get_stats():
+    """ Return statistics collected in the current thread: mapping of names
+        to ``[calls, seconds, queries]`` lists.
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        stats = _local.stats = {}
+    return stats
+
+
+def reset_stats():
+    _local.stats = {}
+
+
+def get_query_count():
+    """ Return number of queries executed by the current thread. Queries
+        are counted regardless of ``DEBUG`` when instrumentation is enabled.
+    """
+    return getattr(_local, 'queries', 0)
+
+
+class CountingCursorWrapper(object):
+    """ Cursor wrapper counting executed queries of the current thread. """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def _count(self):
+        _local.queries = get_query_count() + 1
+
+    def execute(self, *args, **kwargs):
+        self._count()
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._count()
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def install_query_counter():
+    """ Count queries of all database connections, see ``get_query_count``.
+        Installed on import when instrumentation is enabled, safe to call
+        repeatedly.
+    """
+    # Django does not provide a hook for wrapping cursors, and
+    # ``connection.queries`` is filled in DEBUG mode only
+    cursor = BaseDatabaseWrapper.cursor
+    if getattr(cursor, 'counts_queries', False):
+        return
+
+    @wraps(cursor)
+    def counting_cursor(self):
+        return CountingCursorWrapper(cursor(self))
+    counting_cursor.counts_queries = True
+    BaseDatabaseWrapper.cursor = counting_cursor
+
+if ENABLED:
+    install_query_counter()
+
+
+def instrumented(name):
+    """ Decorator recording calls of function under ``name``. """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            queries = get_query_count()
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                record = get_stats().setdefault(name, [0, 0.0, 0])
+                record[0] += 1
+                record[1] += elapsed
+                record[2] += get_query_count() - queries
+        return wrapper
+    return decorator
+
+
+def format_stats(stats):
+    """ Return compact single line representation of statistics. """
+    return '; '.join('%s=%i/%.1fms/%iq' % (name, calls, seconds * 1000,
+        queries) for name, (calls, seconds, queries) in sorted(stats.items()))
+
+
+class LoggingSink(object):
+    """ Log statistics of every request with ``vk.instrumentation`` logger.
+    """
+    logger = logging.getLogger('vk.instrumentation')
+
+    def emit(self, request, stats):
+        self.logger.debug('%s %s', request.path, format_stats(stats))
+
+
+class CollectorSink(object):
+    """ Aggregate statistics of all requests in the current process, like
+        statsd does. Use ``snapshot`` to read them.
+    """
+    lock = threading.Lock()
+    totals = {}
+
+    def emit(self, request, stats):
+        with self.lock:
+            for name, values in stats.items():
+                total = self.totals.setdefault(name, [0, 0.0, 0])
+                for i, value in enumerate(values):
+                    total[i] += value
+
+    @classmethod
+    def snapshot(cls, reset=False):
+        """ Return copy of aggregated statistics. """
+        with cls.lock:
+            totals = dict((name, list(values))
+                for name, values in cls.totals.items())
+            if reset:
+                cls.totals.clear()
+        return totals
+
+
+def _load_sink(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)()
+
+
+class InstrumentationMiddleware(object):
+    """ Reset statistics on request and pass them to sinks configured in
+        ``VK_INSTRUMENTATION_SINKS`` on response. In DEBUG mode statistics
+        are also returned in ``X-VK-Instrumentation`` response header.
+    """
+
+    def __init__(self):
+        if not ENABLED:
+            raise MiddlewareNotUsed
+        self.sinks = [_load_sink(path) for path in SINKS]
+
+    def process_request(self, request):
+        reset_stats()
+        request._vk_instrumentation = (time.time(), get_query_count())
+
+    def process_response(self, request, response):
+        stats = get_stats()
+        # whole request totals, which include lazy query set evaluation and
+        # rendering not covered by instrumented functions
+        start, queries = getattr(request, '_vk_instrumentation',
+            (time.time(), get_query_count()))
+        stats['request'] = [1, time.time() - start,
+            get_query_count() - queries]
+        for sink in self.sinks:
+            sink.emit(request, stats)
+        if settings.DEBUG:
+            response[HEADER] = format_stats(stats)
+        reset_stats()
+        return response
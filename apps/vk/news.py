@@ -1,26 +1,79 @@
+import datetime
+import operator
+import uuid
+from functools import reduce
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
 from utils.django import get_object_or_none
 from apps.news import models
+from apps.news import visibility
 
+from . import routing
 from . import security
+from . import signals
+from .instrumentation import instrumented
 
 __all__ = [
+    'POST_GRANTS',
+    'PUBLISHED_POST_GRANTS',
     'RECENT_NEWS_POSTS_COUNT',
+    'USE_VISIBILITY_INDEX',
+    'assign_post_permissions',
+    'check_permission_tasks',
+    'check_visibility_index',
     'create_post',
     'delete_post',
+    'drain_permission_tasks',
+    'export_posts',
     'get_latest_published',
     'get_post_by_id',
     'get_post_data',
     'get_posts_for_user',
+    'grant_published_permissions',
+    'import_posts',
     'make_post_data',
+    'rebuild_visibility_index',
+    'revoke_published_permissions',
     'save_post',
+    'sync_post_permissions',
     'update_post',
 ]
 
 
 RECENT_NEWS_POSTS_COUNT = getattr(settings, 'RECENT_NEWS_POSTS_COUNT', 10)
+# Filter posts through the visibility index (see ``apps.news.visibility``).
+# Enable after the index has been built with ``news_rebuild_visibility``.
+USE_VISIBILITY_INDEX = getattr(settings, 'NEWS_USE_VISIBILITY_INDEX', False)
+
+# Object level permissions granted by the news application on every saved
+# post (see ``apps.news.models._news_post_post_save``)...
+POST_GRANTS = (
+    (models.Operations.INDEX_POST,
+        (models.Roles.AUTHOR, models.Roles.MODERATOR)),
+)
+# ...and on every published post (see ``apps.news.models.Post.publish``).
+PUBLISHED_POST_GRANTS = (
+    (models.Operations.INDEX_POST,
+        (models.Roles.READER, security.Roles.ANONYMOUS)),
+    (models.Operations.GET_POST,
+        (models.Roles.READER, security.Roles.ANONYMOUS)),
+)
+
+
+def _get_post(pk, using=None):
+    """ Return post by primary key or ``None``. Post is read from database
+        ``using``, read database by default (see ``vk.routing``).
+    """
+    if using is None:
+        using = routing.get_read_database()
+    posts = list(models.Post.objects.using(using).filter(pk=pk)[:1])
+    return posts and posts[0] or None
 
 
+@instrumented('vk.news.make_post_data')
 def make_post_data(**data):
     """ Construct the composite Transfer Object for ``Post`` model class
         and fill its fields with data passed in arguments.
@@ -31,6 +84,7 @@ def make_post_data(**data):
     return make_model_dto(models.Post, **data)
 
 
+@instrumented('vk.news.get_post_data')
 def get_post_data(val):
     """ Construct the composite Transfer Object for ``Post`` model object.
 
@@ -38,17 +92,19 @@ def get_post_data(val):
     """
     post = val
     if isinstance(post, (int, long, basestring)):
-        post = get_object_or_none(models.Post, pk=post)
+        post = _get_post(post)
     from utils.django import get_object_dto
     return get_object_dto(post)
 
 
+@instrumented('vk.news.get_post_by_id')
 def get_post_by_id(val):
     """ Get news post by its id. """
     if isinstance(val, (int, long, basestring)):
-        return get_object_or_none(models.Post, pk=val)
+        return _get_post(val)
 
 
+@instrumented('vk.news.update_post')
 def update_post(val, data):
     """ Update existing ``Post`` object with data passed in Transfer Object and
         validate instance values.
@@ -59,13 +115,14 @@ def update_post(val, data):
     from utils.django import update_object_from_dto
     post = val
     if isinstance(post, (int, long, basestring)):
-        post = get_object_or_none(models.Post, pk=post)
+        post = _get_post(post, routing.get_write_database())
     if isinstance(post, models.Post):
         update_object_from_dto(post, data, partial=True)
         # TODO(sprymak): validate new instance values
         return post
 
 
+@instrumented('vk.news.create_post')
 def create_post(data=None):
     """ Create new ``Post`` object with data passed in `data` argument.
         This function does not call ``save`` method on resulting object.
@@ -78,15 +135,18 @@ def create_post(data=None):
     return update_post(instance, data)
 
 
+@instrumented('vk.news.save_post')
 def save_post(val):
     """ Save ``Post`` object and all its' descendants. Update cache and
         permissions if necessary.
     """
     if isinstance(val, models.Post):
-        val.save()
+        val.save(using=routing.get_write_database())
+        routing.pin()
     return val
 
 
+@instrumented('vk.news.delete_post')
 def delete_post(val):
     """ Delete news post.
 
@@ -94,11 +154,13 @@ def delete_post(val):
     """
     post = val
     if isinstance(post, (int, long, basestring)):
-        post = get_object_or_none(models.Post, pk=post)
+        post = _get_post(post, routing.get_write_database())
     if isinstance(post, models.Post):
         post.delete()
+        routing.pin()
 
 
+@instrumented('vk.news.publish_post')
 def publish_post(val):
     """ Publish news post.
         Note: ``save`` method will be called first if post has not been
@@ -107,11 +169,13 @@ def publish_post(val):
     """
     post = val
     if isinstance(post, (int, long, basestring)):
-        post = get_object_or_none(models.Post, pk=post)
+        post = _get_post(post, routing.get_write_database())
     if isinstance(post, models.Post):
         post.publish()
+        routing.pin()
 
 
+@instrumented('vk.news.recall_post')
 def recall_post(val):
     """ Recall published news post.
         Note: ``save`` method will be called first if post has not been
@@ -120,35 +184,451 @@ def recall_post(val):
     """
     post = val
     if isinstance(post, (int, long, basestring)):
-        post = get_object_or_none(models.Post, pk=post)
+        post = _get_post(post, routing.get_write_database())
     if isinstance(post, models.Post):
         post.recall()
+        routing.pin()
+
+
+# fields of exported posts, besides ``author`` and ``markup_type``
+EXPORT_FIELDS = ('uid', 'title', 'slug', 'content', 'teaser', 'tags',
+    'is_published', 'date_created', 'date_updated', 'date_published',
+    'date_scheduled')
+EXPORT_DATE_FIELDS = ('date_created', 'date_updated', 'date_published',
+    'date_scheduled')
+EXPORT_DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def _export_post(post):
+    row = {}
+    for name in EXPORT_FIELDS:
+        value = getattr(post, name)
+        if name in ('content', 'teaser'):
+            value = value.raw
+        elif name in EXPORT_DATE_FIELDS and value is not None:
+            value = value.isoformat()
+        row[name] = value
+    row['author'] = post.author.username
+    row['scheduled_by'] = (post.scheduled_by_id and
+        post.scheduled_by.username or None)
+    row['markup_type'] = post.content.markup_type
+    return row
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    for format in EXPORT_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date: %r" % value)
+
+
+def export_posts(posts=None, chunk_size=models.BULK_CHUNK_SIZE):
+    """ Yield dictionaries of post data suitable for ``import_posts``.
+        Posts are fetched in chunks ordered by primary key, so memory usage
+        does not depend on number of posts.
+
+        :param posts: ``Post`` queryset, all posts by default.
+    """
+    if posts is None:
+        posts = models.Post.objects.all()
+    posts = posts.select_related('author', 'scheduled_by').order_by('pk')
+    last_pk = None
+    while True:
+        chunk = posts
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        for post in chunk:
+            yield _export_post(post)
+        if len(chunk) < chunk_size:
+            break
+        last_pk = chunk[-1].pk
+
+
+def _import_chunk(rows, site, authors, default_author):
+    # posts imported before are looked up in the write database, pins made
+    # by saves end with the chunk (see ``vk.routing``)
+    with routing.pinned():
+        with transaction.commit_on_success():
+            return _import_rows(rows, site, authors, default_author)
+
+
+def _get_site_uid(uid, site):
+    """ Return uid of post exported with ``uid`` imported into ``site`` if
+        ``uid`` is taken by post of another site.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, '%s:%s' % (site, uid)))
+
+
+def _get_author(username, authors):
+    if username not in authors:
+        authors[username] = get_object_or_none(User, username=username)
+    return authors[username]
+
+
+def _import_rows(rows, site, authors, default_author):
+    uids = [row['uid'] for row in rows if row.get('uid')]
+    # uids are unique across sites, so posts imported into another site get
+    # uids derived from the original ones
+    taken = dict(models.Post.objects.filter(uid__in=uids + [
+        _get_site_uid(uid, site) for uid in uids]).values_list('uid', 'site'))
+    imported = []
+    for row in rows:
+        uid = row.get('uid')
+        if uid and taken.get(uid, site) != site:
+            uid = _get_site_uid(uid, site)
+        if uid in taken:
+            continue
+        data = dict((name, row[name]) for name in EXPORT_FIELDS
+            if name in row and name not in EXPORT_DATE_FIELDS)
+        if uid:
+            data['uid'] = uid
+        username = row.get('author')
+        data['author'] = _get_author(username, authors) or default_author
+        if data['author'] is None:
+            raise ValueError("Unknown author of post %s: %r" % (
+                row.get('uid'), username))
+        for name in ('date_published', 'date_scheduled'):
+            data[name] = _parse_date(row.get(name))
+        post = create_post(make_post_data(**data))
+        post.site_id = site
+        if post.date_scheduled and row.get('scheduled_by'):
+            # unknown user leaves permission check to the author
+            post.scheduled_by = _get_author(row['scheduled_by'], authors)
+        if row.get('markup_type'):
+            post.content.markup_type = row['markup_type']
+        post.save()
+        # keep dates overwritten by auto_now fields on save
+        dates = dict((name, _parse_date(row.get(name)))
+            for name in ('date_created', 'date_updated'))
+        dates = dict((name, value) for name, value in dates.items() if value)
+        if dates:
+            models.Post.objects.filter(pk=post.pk).update(**dates)
+        taken[post.uid] = site
+        imported.append(post)
+    if not models.DEFERRED_PERMISSIONS:
+        grant_published_permissions([post for post in imported
+            if post.is_published])
+    return len(imported), len(rows) - len(imported)
+
+
+def import_posts(rows, site=None, default_author=None,
+        chunk_size=models.BULK_CHUNK_SIZE):
+    """ Create posts from dictionaries written by ``export_posts``. Rows are
+        read and imported in chunks, one transaction per chunk. Posts whose
+        ``uid`` exists on the target site already are skipped, so interrupted
+        import can be resumed by importing the same rows again. Posts whose
+        ``uid`` is taken on another site are imported with ``uid`` derived
+        from the original one and the site.
+
+        Yield ``(imported, skipped)`` numbers of posts per chunk.
+
+        :param site: site id of imported posts, current site by default.
+        :param default_author: ``User`` set as author of posts whose author
+          does not exist. Such posts raise ``ValueError`` by default.
+    """
+    if site is None:
+        site = settings.SITE_ID
+    authors = {}
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield _import_chunk(chunk, site, authors, default_author)
+            chunk = []
+    if chunk:
+        yield _import_chunk(chunk, site, authors, default_author)
+
+
+@instrumented('vk.news.grant_published_permissions')
+def grant_published_permissions(posts):
+    """ Grant ``PUBLISHED_POST_GRANTS`` permissions on posts. """
+    posts = list(posts)
+    for operation, roles in PUBLISHED_POST_GRANTS:
+        security.grant_permission_bulk(operation, list(roles), posts)
+
+
+@instrumented('vk.news.revoke_published_permissions')
+def revoke_published_permissions(posts):
+    """ Revoke ``PUBLISHED_POST_GRANTS`` permissions on posts. """
+    posts = list(posts)
+    for operation, roles in PUBLISHED_POST_GRANTS:
+        security.revoke_permission_bulk(operation, list(roles), posts)
+
+
+@instrumented('vk.news.assign_post_permissions')
+def assign_post_permissions(posts):
+    """ Assign author role and grant ``POST_GRANTS`` permissions on posts.
+    """
+    posts = list(posts)
+    for post in posts:
+        security.assign_roles(models.Roles.AUTHOR, post.author, post)
+    for operation, roles in POST_GRANTS:
+        security.grant_permission_bulk(operation, list(roles), posts)
+
+
+@instrumented('vk.news.sync_post_permissions')
+def sync_post_permissions(posts):
+    """ Bring permissions on posts in line with their current state: assign
+        author role, grant ``POST_GRANTS`` and grant or revoke
+        ``PUBLISHED_POST_GRANTS`` depending on ``is_published``. Safe to call
+        any number of times.
+    """
+    posts = list(posts)
+    assign_post_permissions(posts)
+    grant_published_permissions([p for p in posts if p.is_published])
+    revoke_published_permissions([p for p in posts if not p.is_published])
+
+
+@instrumented('vk.news.drain_permission_tasks')
+def drain_permission_tasks(batch_size=models.BULK_CHUNK_SIZE):
+    """ Process tasks queued in deferred permissions mode (see
+        ``apps.news.tasks``) in batches until queue is empty. Return list of
+        primary keys of processed posts.
+
+        Only processed tasks are deleted, and only unless they have been
+        re-queued (their ``date_queued`` changed) meanwhile, so the latest
+        toggle is never lost. Processing the same post twice is harmless, so
+        several workers may drain queue at once.
+    """
+    processed = []
+    queue = models.PermissionTask.objects.order_by('date_queued')
+    # reads of the worker go to the write database and do not stay pinned
+    with routing.pinned():
+        while True:
+            tasks = list(queue.values_list('pk', 'post', 'date_queued')[
+                :batch_size])
+            if not tasks:
+                break
+            pks = [post for pk, post, date_queued in tasks]
+            # tasks queued together share date_queued, so groups are few
+            queued = {}
+            for pk, post, date_queued in tasks:
+                queued.setdefault(date_queued, []).append(pk)
+            with transaction.commit_on_success():
+                sync_post_permissions(models.Post.objects.filter(
+                    pk__in=pks).select_related('author'))
+                for date_queued, task_pks in queued.items():
+                    models.PermissionTask.objects.filter(pk__in=task_pks,
+                        date_queued=date_queued).delete()
+            processed.extend(pks)
+            if len(tasks) < batch_size:
+                break
+    return processed
+
+
+def check_permission_tasks(pks):
+    """ Yield ``(post, message)`` for every post with primary key in ``pks``
+        whose permissions do not match its state.
+    """
+    for chunk in models.chunks(list(pks)):
+        for result in check_visibility_index(
+                models.Post.objects.filter(pk__in=chunk)):
+            yield result
+
+
+def _granted_roles(grants, operation):
+    """ Return set of roles ``operation`` is granted to by ``grants``. """
+    roles = set()
+    for op, op_roles in grants:
+        if op == operation:
+            roles.update(op_roles)
+    return roles
+
+
+class PostSecurityPolicy(security.SecurityPolicy):
+    """ Evaluates permissions for many posts at once.
+
+        Object level permissions are granted by the news application itself
+        (``POST_GRANTS`` and ``PUBLISHED_POST_GRANTS``), so they are derived
+        from post fields and translated into SQL conditions. Roles assigned
+        on single posts are read from ``PostRoleAssignment`` rows, which
+        mirror role assignments made through ``vk.security.assign_roles``,
+        and joined by ``filter_queryset`` with or without the visibility
+        index.
+    """
+
+    def get_user_roles(self, user, posts):
+        posts = list(posts)
+        model_roles = security.get_user_roles(user, models.Post)
+        assigned = visibility.get_assigned_roles(
+            security.get_user_security_subjects(user), posts)
+        result = {}
+        for post in posts:
+            roles = list(model_roles)
+            for role in sorted(assigned.get(post.pk, ())):
+                if role not in roles:
+                    roles.append(role)
+            if (user is not None and post.author_id == user.pk and
+                    models.Roles.AUTHOR not in roles):
+                roles.append(models.Roles.AUTHOR)
+            result[post] = roles
+        return result
+
+    def filter_objects(self, posts, operation, user):
+        qs = models.Post.objects.filter(pk__in=[post.pk for post in posts])
+        permitted = set(self.filter_queryset(qs, operation, user).values_list(
+            'pk', flat=True))
+        return [post for post in posts if post.pk in permitted]
+
+    def filter_queryset(self, queryset, operation, user):
+        roles = set(security.get_user_roles(user, models.Post))
+        if (security.has_permissions(models.Post, operation, list(roles)) or
+                roles & _granted_roles(POST_GRANTS, operation)):
+            return queryset
+        if USE_VISIBILITY_INDEX:
+            return self._filter_indexed(queryset, operation, user, roles)
+        conditions = []
+        if roles & _granted_roles(PUBLISHED_POST_GRANTS, operation):
+            conditions.append(Q(is_published=True))
+        if user is not None and (
+                models.Roles.AUTHOR in _granted_roles(POST_GRANTS, operation)
+                or security.has_permissions(models.Post, operation,
+                    [models.Roles.AUTHOR])):
+            conditions.append(Q(author=user))
+        subjects = security.get_user_security_subjects(user)
+        if subjects:
+            conditions.extend(self._get_assigned_conditions(operation,
+                subjects))
+        if not conditions:
+            # unlike none() keeps PostQuerySet methods available
+            return queryset.filter(pk__in=[])
+        return queryset.filter(reduce(operator.or_, conditions))
+
+    def _get_assigned_conditions(self, operation, subjects):
+        """ Return conditions selecting posts operation is permitted on by
+            roles assigned on them to security subjects.
+        """
+        granted = _granted_roles(POST_GRANTS, operation)
+        published_granted = _granted_roles(PUBLISHED_POST_GRANTS, operation)
+        roles, published_roles = [], []
+        for role, description in models.Post.Security.roles:
+            if (role in granted or security.has_permissions(models.Post,
+                    operation, [role])):
+                roles.append(role)
+            elif role in published_granted:
+                published_roles.append(role)
+        conditions = []
+        if roles:
+            conditions.append(visibility.get_assigned_condition(subjects,
+                roles))
+        if published_roles:
+            conditions.append(Q(is_published=True) &
+                visibility.get_assigned_condition(subjects, published_roles))
+        return conditions
+
+    def _filter_indexed(self, queryset, operation, user, roles):
+        model_roles = [role for role, description in
+            models.Post.Security.roles
+                if security.has_permissions(models.Post, operation, [role])]
+        return queryset.filter(visibility.get_condition(operation,
+            list(roles), security.get_user_security_subjects(user),
+            model_roles))
+
+security.register_policy(models.Post, PostSecurityPolicy())
+
+
+# maintain visibility index of posts
+
+def _posts_only(objs):
+    return [obj for obj in objs if isinstance(obj, models.Post)]
+
+
+def _permission_granted(sender, operation, roles, objs, **kwargs):
+    visibility.add_grants(operation, roles, _posts_only(objs))
+
+
+def _permission_revoked(sender, operation, roles, objs, **kwargs):
+    visibility.remove_grants(operation, roles, _posts_only(objs))
+
+
+def _roles_assigned(sender, roles, subjects, obj, **kwargs):
+    if isinstance(obj, models.Post):
+        visibility.add_role_assignments(roles, subjects, obj)
+
+signals.permission_granted.connect(_permission_granted, sender=models.Post)
+signals.permission_revoked.connect(_permission_revoked, sender=models.Post)
+signals.roles_assigned.connect(_roles_assigned, sender=models.Post)
+
+
+@instrumented('vk.news.rebuild_visibility_index')
+def rebuild_visibility_index(posts=None):
+    """ Rebuild visibility index for posts (all posts by default).
+        Return number of posts processed.
+    """
+    if posts is None:
+        posts = models.Post.objects.all()
+    return visibility.rebuild(posts, POST_GRANTS, PUBLISHED_POST_GRANTS)
+
 
+def check_visibility_index(posts=None):
+    """ Compare visibility index with RBAC data. Yield ``(post, message)``
+        pairs describing inconsistencies found.
 
-def get_latest_published(user, count=None):
-    """ Get recently published news posts indexable by user.
+        Only object level data are compared: permissions granted to roles on
+        model level are not indexed.
+    """
+    if posts is None:
+        posts = models.Post.objects.all()
+    for post in posts.select_related('author').iterator():
+        grants = set(post.grants.values_list('operation', 'role'))
+        for expected_grants, expected in ((POST_GRANTS, True),
+                (PUBLISHED_POST_GRANTS, post.is_published)):
+            for operation, roles in expected_grants:
+                for role in roles:
+                    if security.has_permissions(models.Post, operation,
+                            [role]):
+                        continue
+                    granted = security.has_permissions(post, operation,
+                        [role])
+                    indexed = (operation, role) in grants
+                    if granted != indexed or granted != expected:
+                        yield post, ("%s granted to %s: RBAC %s, index %s, "
+                            "expected %s" % (operation, role, granted,
+                                indexed, expected))
+        assigned = models.Roles.AUTHOR in security.get_user_roles(
+            post.author, post)
+        indexed = post.role_assignments.filter(role=models.Roles.AUTHOR,
+            subject_type=ContentType.objects.get_for_model(User),
+            subject_id=post.author_id).exists()
+        if assigned != indexed:
+            yield post, "%s assigned to %s: RBAC %s, index %s" % (
+                models.Roles.AUTHOR, post.author, assigned, indexed)
+
+
+@instrumented('vk.news.get_latest_published')
+def get_latest_published(user, count=None, site=None):
+    """ Get recently published news posts of site indexable by user.
 
         :param user: user id or User object.
         :param count: maximum number of posts to return. Defaults to
           ``django.conf.settings.RECENT_NEWS_POSTS_COUNT``.
+        :param site: site id, defaults to the current site.
     """
     if not count:
         count = RECENT_NEWS_POSTS_COUNT
     operation = models.Operations.INDEX_POST
-    qs = models.Post.objects.published()
-    return [post for post in qs if security.has_permissions(post, operation,
-        security.get_user_roles(user, post))][:count]
+    qs = models.Post.objects.using(routing.get_read_database()).on_site(
+        site).published()
+    return security.filter_permitted(qs, operation, user)[:count]
 
 
-def get_posts_for_user(user, operation=None):
-    """ Get news posts indexable by user (including not published).
+@instrumented('vk.news.get_posts_for_user')
+def get_posts_for_user(user, operation=None, site=None):
+    """ Get news posts of site indexable by user (including not published).
+        Returns lazy ``PostQuerySet`` ordered by publication date.
 
         :param user: user id or User object.
         :param operation: required permission. Defaults to 'news.get_post'
+        :param site: site id, defaults to the current site.
     """
     if not operation:
         operation = models.Operations.INDEX_POST
 
-    qs = models.Post.objects.all()
-    return [post for post in qs if security.has_permissions(post, operation,
-        security.get_user_roles(user, post))]
+    qs = models.Post.objects.using(routing.get_read_database()).on_site(
+        site)
+    return security.filter_permitted(qs, operation, user)
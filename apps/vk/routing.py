@@ -0,0 +1,133 @@
+""" Routing of reads to read replicas with read-your-writes stickiness.
+
+    Writes go to ``VK_WRITE_DATABASE`` (``'default'``), reads to randomly
+    chosen database of ``VK_READ_DATABASES`` (none by default, which routes
+    reads to the write database too). Enable with::
+
+        DATABASES = {
+            'default': {...},
+            'replica': {..., 'TEST_MIRROR': 'default'},
+        }
+        VK_READ_DATABASES = ('replica',)
+        DATABASE_ROUTERS = ('vk.routing.ReplicaRouter',)
+        MIDDLEWARE_CLASSES += ('vk.routing.StickinessMiddleware',)
+
+    Replicas lag behind the write database, so code that has just written
+    data calls ``pin``: reads of the current thread go to the write database
+    from then on, and ``StickinessMiddleware`` keeps reads of the following
+    requests of the same client there for ``VK_STICKY_SECONDS``. Outside of
+    requests (commands, worker threads, tests) run units of work in
+    ``pinned`` block, so that their pins are dropped when they end.
+
+    Locally it can be tried with two SQLite databases, the replica being a
+    copy of the default database file refreshed by hand.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+WRITE_DATABASE = getattr(settings, 'VK_WRITE_DATABASE', 'default')
+READ_DATABASES = tuple(getattr(settings, 'VK_READ_DATABASES', ()))
+# seconds reads of client stay on write database after write
+STICKY_SECONDS = getattr(settings, 'VK_STICKY_SECONDS', 10)
+STICKY_COOKIE = 'vk_sticky'
+
+_state = threading.local()
+
+
+def pin(sticky=True):
+    """ Route reads of the current thread to the write database. Call it
+        after write whose results must be visible to the following reads.
+
+        :param sticky: keep reads of the following requests of the client on
+            the write database too (see ``StickinessMiddleware``).
+    """
+    _state.pinned = True
+    if sticky:
+        _state.wrote = True
+
+
+def unpin():
+    _state.pinned = False
+    _state.wrote = False
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+@contextmanager
+def pinned():
+    """ Route reads of the current thread to the write database inside the
+        block. State of the thread is restored on exit, so pins made inside
+        the block do not leak into the following units of work.
+    """
+    state = is_pinned(), getattr(_state, 'wrote', False)
+    _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned, _state.wrote = state
+
+
+def get_read_database():
+    """ Return alias of database to read from. """
+    if is_pinned() or not READ_DATABASES:
+        return WRITE_DATABASE
+    return random.choice(READ_DATABASES)
+
+
+def get_write_database():
+    """ Return alias of database to write to. """
+    return WRITE_DATABASE
+
+
+class ReplicaRouter(object):
+    """ Routes reads to replicas and writes to the write database. """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        # read related objects from the database the instance comes from
+        if instance is not None and instance._state.db:
+            if is_pinned():
+                return WRITE_DATABASE
+            return instance._state.db
+        return get_read_database()
+
+    def db_for_write(self, model, **hints):
+        return WRITE_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = (WRITE_DATABASE,) + READ_DATABASES
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        # replicas get tables by replication
+        return db == WRITE_DATABASE
+
+
+class StickinessMiddleware(object):
+    """ Keeps reads on the write database for ``VK_STICKY_SECONDS`` after the
+        request which has called ``pin``.
+    """
+
+    def process_request(self, request):
+        unpin()
+        try:
+            sticky_until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            sticky_until = 0
+        if sticky_until > time.time():
+            _state.pinned = True
+
+    def process_response(self, request, response):
+        # stickiness is extended by writes only
+        if getattr(_state, 'wrote', False):
+            response.set_cookie(STICKY_COOKIE,
+                str(time.time() + STICKY_SECONDS), max_age=STICKY_SECONDS)
+        unpin()
+        return response
@@ -1,8 +1,19 @@
-from django.contrib.auth.models import User
+import time
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import get_cache
+from django.db import connections, router, transaction
+from django.db.models import signals
+from django.db.models.query import QuerySet
+from django.utils.hashcompat import md5_constructor
 
-from utils.django import get_object_or_none
 import rbac
 
+from . import routing
+from . import signals as vk_signals
+from .instrumentation import instrumented
+
 
 class Roles:
     ALL = 'vk.all'
@@ -10,12 +21,335 @@ class Roles:
     SUPERUSER = 'vk.superuser'
 
 
-assign_roles = rbac.assign_roles
-has_permissions = rbac.has_permissions
-grant_permission = rbac.grant_permission
-revoke_permission = rbac.revoke_permission
+has_permissions = instrumented('vk.security.has_permissions')(
+    rbac.has_permissions)
+
+
+# Security subjects and roles of user are memoized on ``User`` instance, so
+# for ``request.user`` they are resolved once per request. The generation
+# counter is bumped whenever group or profile membership or role assignment
+# changes, which drops all memoized values in the current process.
+_cache_generation = 0
+
+
+def invalidate_security_cache():
+    """ Drop security subjects and roles memoized on ``User`` instances. """
+    global _cache_generation
+    _cache_generation += 1
+
+
+def _get_security_cache(user):
+    cache = getattr(user, '_vk_security_cache', None)
+    if cache is None or cache['generation'] != _cache_generation:
+        cache = {'generation': _cache_generation, 'subjects': None,
+            'roles': {}}
+        user._vk_security_cache = cache
+    return cache
+
+
+def _get_object_key(obj):
+    """ Return hashable key identifying security target object or ``None`` if
+        object can not be identified (i.e. it has not been saved yet).
+    """
+    if obj is None:
+        return ()
+    if isinstance(obj, type):
+        return (obj._meta.app_label, obj._meta.object_name)
+    if getattr(obj, 'pk', None) is None:
+        return None
+    # deferred instances share keys with regular ones
+    opts = _get_model(obj)._meta
+    return (opts.app_label, opts.object_name, obj.pk)
+
+
+# Permission decisions of ``permission_required`` are cached for
+# ``VK_PERMISSION_CACHE_TIMEOUT`` seconds in ``VK_PERMISSION_CACHE`` backend.
+# Their keys include versions of the object, its model and of security
+# subjects in general, which are changed by grants, revokes and role
+# assignments on the object or model and by changes of group or profile
+# membership.
+#
+# The cache is disabled by default. Versions reach other processes only
+# through a cache shared by all of them (memcached, database), so enable it
+# with such a backend only: with a process local one (locmem) a revoked
+# permission stays allowed in other processes for up to the timeout. Changes
+# made bypassing this module are picked up when decisions expire, so the
+# timeout bounds staleness in any case.
+DECISION_CACHE = getattr(settings, 'VK_PERMISSION_CACHE', 'default')
+DECISION_TIMEOUT = getattr(settings, 'VK_PERMISSION_CACHE_TIMEOUT', 0)
+# versions must outlive decisions depending on them
+VERSION_TIMEOUT = 60 * 60 * 24
+SUBJECTS_VERSION_KEY = 'vk.security.version'
+
+
+def _get_version_key(key):
+    return 'vk.security.version.%s' % md5_constructor(
+        repr(key)).hexdigest()
+
+
+def _get_objects_version_key(model):
+    # version of permissions on any object of model
+    return _get_version_key(('objects',) + _get_object_key(model))
+
+
+def invalidate_decisions(objs=None):
+    """ Drop cached permission decisions on objects or model classes, on
+        everything if ``objs`` is ``None``.
+    """
+    if objs is None:
+        keys = [SUBJECTS_VERSION_KEY]
+    else:
+        keys = [_get_version_key(_get_object_key(obj)) for obj in objs]
+        keys.extend(_get_objects_version_key(model)
+            for model in _group_by_model(objs) if model is not None)
+    now = time.time()
+    get_cache(DECISION_CACHE).set_many(dict((key, now) for key in keys),
+        VERSION_TIMEOUT)
+
+
+def _get_decision_key(user, operation, obj):
+    obj_key = _get_object_key(obj)
+    version_keys = [SUBJECTS_VERSION_KEY, _get_version_key(obj_key)]
+    model = _get_model(obj)
+    if model is not None and model is not obj:
+        version_keys.append(_get_version_key(_get_object_key(model)))
+    versions = get_cache(DECISION_CACHE).get_many(version_keys)
+    key = '%s:%s:%r:%s' % (user and user.pk, operation, obj_key,
+        ':'.join([str(versions.get(key)) for key in version_keys]))
+    return 'vk.security.decision.%s' % md5_constructor(key).hexdigest()
+
+
+def get_permissions_version(model):
+    """ Return time (seconds since epoch) permissions on ``model`` or any of
+        its objects or security subjects have been changed last, ``0`` if it
+        is not known. Include it into keys and ETags of pages depending on
+        permissions of many objects.
+    """
+    versions = get_cache(DECISION_CACHE).get_many([SUBJECTS_VERSION_KEY,
+        _get_version_key(_get_object_key(model)),
+        _get_objects_version_key(model)])
+    return max(versions.values() or [0])
+
+
+@instrumented('vk.security.check_permission')
+def check_permission(user, operation, obj):
+    """ Return ``True`` if user is allowed to perform operation on object.
+        Decisions are cached, see ``VK_PERMISSION_CACHE_TIMEOUT``.
+
+        :param user: user id or User class instance.
+        :param obj: target object, model class or ``None``.
+    """
+    user = get_user(user)
+    if not DECISION_TIMEOUT or _get_object_key(obj) is None:
+        return bool(has_permissions(obj, operation,
+            get_user_roles(user, obj)))
+    cache = get_cache(DECISION_CACHE)
+    key = _get_decision_key(user, operation, obj)
+    decision = cache.get(key)
+    if decision is None:
+        decision = bool(has_permissions(obj, operation,
+            get_user_roles(user, obj)))
+        cache.set(key, decision, DECISION_TIMEOUT)
+    return decision
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _get_model(obj):
+    """ Return model class of object, or object itself if it is not a model
+        instance.
+    """
+    if obj is None or isinstance(obj, type):
+        return obj
+    model = obj.__class__
+    if getattr(model, '_deferred', False):
+        model = model._meta.proxy_for_model
+    return model
+
+
+def _group_by_model(objs):
+    groups = {}
+    for obj in objs:
+        groups.setdefault(_get_model(obj), []).append(obj)
+    return groups
+
+
+def assign_roles(roles, subjects, obj):
+    """ Assign roles to security subjects (see ``rbac.assign_roles``) and
+        drop memoized user roles.
+    """
+    result = rbac.assign_roles(roles, subjects, obj)
+    invalidate_security_cache()
+    vk_signals.roles_assigned.send(sender=_get_model(obj),
+        roles=_as_list(roles), subjects=_as_list(subjects), obj=obj)
+    return result
+
+
+def grant_permission(operation, roles, obj):
+    """ Grant permission to roles on object (see ``rbac.grant_permission``).
+    """
+    result = rbac.grant_permission(operation, roles, obj)
+    vk_signals.permission_granted.send(sender=_get_model(obj),
+        operation=operation, roles=_as_list(roles), objs=[obj])
+    return result
+
+
+def revoke_permission(operation, roles, obj):
+    """ Revoke permission from roles on object (see
+        ``rbac.revoke_permission``).
+    """
+    result = rbac.revoke_permission(operation, roles, obj)
+    vk_signals.permission_revoked.send(sender=_get_model(obj),
+        operation=operation, roles=_as_list(roles), objs=[obj])
+    return result
+
+
+def bulk_insert(model, fields, rows, using=None):
+    """ Insert ``rows`` (tuples of values of ``fields``) into table of
+        ``model`` with single ``executemany``. Neither ``save`` nor signals
+        are called and values are passed to database as is, so use primary
+        keys for foreign keys.
+    """
+    if not rows:
+        return
+    if using is None:
+        using = router.db_for_write(model)
+    qn = connections[using].ops.quote_name
+    columns = [qn(model._meta.get_field(name).column) for name in fields]
+    connections[using].cursor().executemany(
+        'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table),
+            ', '.join(columns), ', '.join(['%s'] * len(columns))),
+        list(rows))
+    transaction.commit_unless_managed(using=using)
+
+
+# maximum number of objects whose permissions are changed by single query
+BULK_CHUNK_SIZE = 500
+
+
+def _chunks(values, size=BULK_CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _get_named_rows(model, names, using):
+    """ Return mapping of ``names`` to primary keys of RBAC rows of
+        ``model`` (operations or roles), creating missing rows as
+        ``rbac.grant_permission`` does.
+    """
+    def get_rows():
+        return dict(model._default_manager.using(using).filter(
+            name__in=names).values_list('name', 'pk'))
+    rows = get_rows()
+    missing = [name for name in set(names) if name not in rows]
+    if missing:
+        fields = ('name',)
+        values = [(name,) for name in missing]
+        if 'description' in model._meta.get_all_field_names():
+            fields += ('description',)
+            values = [row + ('',) for row in values]
+        bulk_insert(model, fields, values, using)
+        rows = get_rows()
+    return rows
+
+
+class _ObjectPermissions(object):
+    """ RBAC object permission rows of operation on ``objs`` of ``model``,
+        changed for all objects at once with constant number of queries.
+    """
+
+    def __init__(self, operation, roles, model, objs):
+        from rbac.models import ObjectPermission, Operation, Role
+        self.model = ObjectPermission
+        self.using = router.db_for_write(ObjectPermission)
+        self.content_type = ContentType.objects.get_for_model(model)
+        self.operation_pk = _get_named_rows(Operation, [operation],
+            self.using)[operation]
+        self.role_pks = _get_named_rows(Role, _as_list(roles),
+            self.using).values()
+        self.object_pks = [obj.pk for obj in objs]
+        field = ObjectPermission._meta.get_field('roles')
+        self.through = field.rel.through
+        self.permission_name = field.m2m_field_name()
+        self.role_name = field.m2m_reverse_field_name()
+
+    def get_rows(self):
+        """ Return mapping of object primary keys (as unicode) to primary
+            keys of existing permission rows.
+        """
+        qs = self.model._default_manager.using(self.using).filter(
+            content_type=self.content_type, operation=self.operation_pk,
+            object_id__in=self.object_pks)
+        return dict((unicode(object_id), pk)
+            for pk, object_id in qs.values_list('pk', 'object_id'))
+
+    def get_role_rows(self, permission_pks):
+        return self.through._default_manager.using(self.using).filter(**{
+            '%s__in' % self.permission_name: permission_pks,
+            '%s__in' % self.role_name: self.role_pks})
 
+    def grant(self):
+        rows = self.get_rows()
+        missing = [pk for pk in self.object_pks if unicode(pk) not in rows]
+        if missing:
+            bulk_insert(self.model, ('content_type', 'object_id',
+                'operation'), [(self.content_type.pk, pk, self.operation_pk)
+                    for pk in missing], self.using)
+            rows = self.get_rows()
+        permission_pks = set(rows.values())
+        existing = set(self.get_role_rows(permission_pks).values_list(
+            self.permission_name, self.role_name))
+        bulk_insert(self.through, (self.permission_name, self.role_name),
+            [(permission_pk, role_pk) for permission_pk in permission_pks
+                for role_pk in self.role_pks
+                    if (permission_pk, role_pk) not in existing], self.using)
 
+    def revoke(self):
+        self.get_role_rows(self.get_rows().values()).delete()
+
+
+def grant_permission_bulk(operation, roles, objs):
+    """ Grant permission to roles on every object in collection.
+        See ``grant_permission``.
+    """
+    for model, model_objs in _group_by_model(objs).items():
+        for chunk in _chunks(model_objs):
+            _ObjectPermissions(operation, roles, model, chunk).grant()
+        vk_signals.permission_granted.send(sender=model,
+            operation=operation, roles=_as_list(roles), objs=model_objs)
+
+
+def revoke_permission_bulk(operation, roles, objs):
+    """ Revoke permission from roles on every object in collection.
+        See ``revoke_permission``.
+    """
+    for model, model_objs in _group_by_model(objs).items():
+        for chunk in _chunks(model_objs):
+            _ObjectPermissions(operation, roles, model, chunk).revoke()
+        vk_signals.permission_revoked.send(sender=model,
+            operation=operation, roles=_as_list(roles), objs=model_objs)
+
+
+def get_user(user):
+    """ Return ``User`` instance or ``None`` if user is not authenticated or
+        does not exist.
+
+        :param user: user id or User class instance.
+    """
+    if isinstance(user, (int, long, basestring)):
+        users = list(User.objects.using(routing.get_read_database())
+            .filter(pk=user)[:1])
+        user = users and users[0] or None
+    if not isinstance(user, User) or user.is_anonymous():
+        return None
+    return user
+
+
+@instrumented('vk.security.get_user_security_subjects')
 def get_user_security_subjects(user):
     """ Return collection of security subjects associated with user.
         Currently, this collection includes the user, as well as the groups
@@ -27,17 +361,21 @@ def get_user_security_subjects(user):
 
         :param user: user id or User class instance.
     """
-    if isinstance(user, (int, long, basestring)):
-        user = get_object_or_none(User, pk=user)
-    if not isinstance(user, User) or user.is_anonymous():
+    user = get_user(user)
+    if user is None:
         return []
-    profile = user.get_profile()
-    return ([user] +
-        [g for g in user.groups.all()] +
-        [c for c in profile.companies.all()] +
-        [l for l in profile.cities.all()])
+    cache = _get_security_cache(user)
+    if cache['subjects'] is None:
+        db = routing.get_read_database()
+        profile = user.get_profile()
+        cache['subjects'] = ([user] +
+            [g for g in user.groups.using(db)] +
+            [c for c in profile.companies.using(db)] +
+            [l for l in profile.cities.using(db)])
+    return list(cache['subjects'])
 
 
+@instrumented('vk.security.get_user_roles')
 def get_user_roles(user, obj):
     """ Return collection of active user roles associated with object or
         [anonymous] if user is not authenticated or is not User class instance.
@@ -47,22 +385,166 @@ def get_user_roles(user, obj):
             descendant.
     """
     roles = [Roles.ALL]
-    if isinstance(user, (int, long, basestring)):
-        user = get_object_or_none(User, pk=user)
-    if isinstance(user, User) and not user.is_anonymous():
-        roles.extend(rbac.get_active_roles(obj,
-            get_user_security_subjects(user)))
-    else:
+    user = get_user(user)
+    if user is None:
         roles.extend([Roles.ANONYMOUS])
-    return roles
+        return roles
+    key = _get_object_key(obj)
+    cache = _get_security_cache(user)['roles']
+    if key not in cache:
+        active_roles = list(rbac.get_active_roles(obj,
+            get_user_security_subjects(user)))
+        if key is None:
+            return roles + active_roles
+        cache[key] = active_roles
+    return roles + cache[key]
+
+
+class SecurityPolicy(object):
+    """ Evaluates user roles and permissions for many objects of one model at
+        once.
+
+        Default policy asks RBAC about every single object. Applications that
+        know how object level permissions of their models are granted
+        register specialized policies with ``register_policy``, which
+        evaluate whole collections with a constant number of queries.
+    """
+
+    def get_user_roles(self, user, objs):
+        """ Return mapping of objects to collections of active user roles. """
+        return dict((obj, get_user_roles(user, obj)) for obj in objs)
+
+    def filter_objects(self, objs, operation, user):
+        """ Return list of objects user is allowed to perform operation on. """
+        roles = self.get_user_roles(user, objs)
+        return [obj for obj in objs
+            if has_permissions(obj, operation, roles[obj])]
+
+    def filter_queryset(self, queryset, operation, user):
+        """ Restrict query set to objects user is allowed to perform
+            operation on.
+        """
+        permitted = self.filter_objects(list(queryset), operation, user)
+        return queryset.filter(pk__in=[obj.pk for obj in permitted])
+
+
+_default_policy = SecurityPolicy()
+_policies = {}
+
+
+def register_policy(model, policy):
+    """ Use ``policy`` to evaluate permissions for ``model`` objects. """
+    _policies[model] = policy
+
+
+def get_policy(model):
+    """ Return security policy registered for ``model``. """
+    return _policies.get(model, _default_policy)
+
+
+def get_user_roles_bulk(user, objs):
+    """ Return mapping of objects to collections of active user roles.
+        See ``get_user_roles``.
+
+        :param user: user id or User class instance.
+        :param objs: collection of Model instances.
+    """
+    user = get_user(user)
+    result = {}
+    for model, model_objs in _group_by_model(objs).items():
+        result.update(get_policy(model).get_user_roles(user, model_objs))
+    return result
+
+
+def filter_permitted(objs, operation, user):
+    """ Return objects user is allowed to perform operation on.
+
+        :param objs: query set or collection of Model instances. Query set
+            filtered in database is returned for query sets, list preserving
+            original order otherwise.
+        :param operation: required permission.
+        :param user: user id or User class instance.
+    """
+    user = get_user(user)
+    if isinstance(objs, QuerySet):
+        return get_policy(objs.model).filter_queryset(objs, operation, user)
+    objs = list(objs)
+    permitted = set()
+    for model, model_objs in _group_by_model(objs).items():
+        permitted.update(id(obj) for obj in
+            get_policy(model).filter_objects(model_objs, operation, user))
+    return [obj for obj in objs if id(obj) in permitted]
+
+
+def _get_profile_model():
+    from django.db.models import get_model
+    profile_module = getattr(settings, 'AUTH_PROFILE_MODULE', None)
+    if profile_module:
+        return get_model(*profile_module.split('.'))
+
+
+def _membership_changed(sender, instance, action, **kwargs):
+    """ Invalidate memoized security subjects when user groups, companies or
+        cities change.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if sender is User.groups.through or _get_profile_model() in (
+            instance.__class__, kwargs.get('model')):
+        invalidate_security_cache()
+        invalidate_decisions()
+
+
+def _subject_deleted(sender, **kwargs):
+    invalidate_security_cache()
+    invalidate_decisions()
+
+
+def _permission_changed(sender, objs, **kwargs):
+    invalidate_decisions(objs)
+
+
+def _roles_assigned(sender, obj, **kwargs):
+    invalidate_decisions([obj])
+
+
+signals.m2m_changed.connect(_membership_changed)
+signals.post_delete.connect(_subject_deleted, sender=Group)
+vk_signals.permission_granted.connect(_permission_changed)
+vk_signals.permission_revoked.connect(_permission_changed)
+vk_signals.roles_assigned.connect(_roles_assigned)
+
+
+class SecuredObjectMixin(object):
+    """ Mixin for single object generic views decorated with
+        ``permission_required``, which reuses object resolved by decorator
+        instead of fetching it again.
+    """
+
+    def get_object(self, queryset=None):
+        obj = getattr(self.request, 'secured_object', None)
+        if isinstance(obj, self.model):
+            return obj
+        if queryset is None:
+            queryset = self.get_queryset()
+        # objects being changed must not be read from lagging replicas
+        return super(SecuredObjectMixin, self).get_object(
+            queryset.using(routing.get_write_database()))
 
 
 def permission_required(operation, lookup_variables=None, **kwargs):
     """ Decorator for views that checks if user has a particular permission
-        enabled.
+        enabled. Object looked up by ``lookup_variables`` is passed to the
+        view in ``request.secured_object``.
+
+        The object is read from the write database, as are permissions of
+        requests which may change data (see ``vk.routing``).
     """
     def internal(view):
+        @instrumented('vk.security.permission_required')
         def wrap(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+                routing.pin(sticky=False)
             obj = None
             if lookup_variables:
                 model, lookups = lookup_variables[0], lookup_variables[1:]
@@ -76,13 +558,14 @@ def permission_required(operation, lookup_variables=None, **kwargs):
                                 "into view function" % view_arg)
                         lookup_dict[lookup] = kwargs[view_arg]
                     from django.shortcuts import get_object_or_404
-                    obj = get_object_or_404(model, **lookup_dict)
+                    obj = get_object_or_404(model._default_manager.using(
+                        routing.get_write_database()), **lookup_dict)
 
-            roles = get_user_roles(request.user, obj)
-            if not has_permissions(obj, operation, roles):
+            if not check_permission(request.user, operation, obj):
                 from django.core.exceptions import PermissionDenied
                 raise PermissionDenied
 
+            request.secured_object = obj
             return view(request, *args, **kwargs)
         return wrap
     return internal
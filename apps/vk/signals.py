@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent by ``vk.security`` after RBAC data has been changed. Sender is the
+# model class of target objects (or target itself for model level changes).
+roles_assigned = Signal(providing_args=['roles', 'subjects', 'obj'])
+permission_granted = Signal(providing_args=['operation', 'roles', 'objs'])
+permission_revoked = Signal(providing_args=['operation', 'roles', 'objs'])